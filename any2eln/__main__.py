@@ -3,23 +3,125 @@
 # License MIT
 import argparse
 import os
+import sys
+from pathlib import Path
 
 from any2eln.labfolder.labfolder import Labfolder
+from any2eln.labfolder.merge import merge
 from any2eln.utils.utils import env_or_ask
+from any2eln.utils.verify import verify
+
+
+def get_shard(value: str) -> tuple[int, int]:
+    """Parse a i/N shard argument"""
+    try:
+        index, count = map(int, value.split('/'))
+    except ValueError:
+        raise argparse.ArgumentTypeError('shard must look like i/N')
+    if not 1 <= index <= count:
+        raise argparse.ArgumentTypeError('shard index must be between 1 and N')
+    return index, count
+
+
+def get_positive_int(value: str) -> int:
+    """Parse an argument that must be at least 1"""
+    try:
+        number = int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError('must be a number')
+    if number < 1:
+        raise argparse.ArgumentTypeError('must be at least 1')
+    return number
 
 
 def main():
     sources = ['labfolder', 'labguru', 'scinote', 'benchling']
     parser = argparse.ArgumentParser(description='any2eln')
-    parser.add_argument('--src', required=True, help='source service you want to export from', choices=sources)
+    parser.add_argument('--src', help='source service you want to export from', choices=sources)
     parser.add_argument('--out_dir', required=False, help='output directory', default='.')
+    parser.add_argument(
+        '--stream-zip', action='store_true', help='write the .eln archives directly, without a staging directory'
+    )
+    parser.add_argument('--resume', help='export directory of an interrupted run to resume')
+    parser.add_argument(
+        '--blob-store', help='directory where payloads are stored by content, to download and store them only once'
+    )
+    parser.add_argument('--since', help='previous export directory, only export what changed since then')
+    parser.add_argument('--http-cache', help='directory where element responses are cached between runs')
+    parser.add_argument('--http-cache-size', type=int, help='maximum size of the http cache in MB', default=1024)
+    parser.add_argument(
+        '--http-cache-offline', action='store_true', help='use cached responses without checking if they changed'
+    )
+    parser.add_argument('--workers', type=int, help='number of concurrent downloads', default=4)
+    parser.add_argument(
+        '--jobs', type=int, help='number of processes packing the archives (default: number of cpus)', default=None
+    )
+    parser.add_argument('--page-size', type=int, help='number of entries to get in a request', default=100)
+    parser.add_argument('--shard', type=get_shard, help='only export the shard i out of N, with i from 1 to N')
+    parser.add_argument(
+        '--shard-by', help='split the shards by author or by entry', choices=['author', 'entry'], default='author'
+    )
+    parser.add_argument(
+        '--progress-interval',
+        type=float,
+        help='print a progress line every N seconds instead of the progress bars, for batch logs',
+        default=None,
+    )
+    parser.add_argument(
+        '--segment-threshold',
+        type=get_positive_int,
+        help='files bigger than this many MB are downloaded in parallel segments',
+        default=100,
+    )
+    parser.add_argument(
+        '--segments', type=get_positive_int, help='number of parallel segments for big files, 1 to disable', default=4
+    )
+    subparsers = parser.add_subparsers(dest='command')
+    merge_parser = subparsers.add_parser('merge', help='merge the exports of several shards')
+    merge_parser.add_argument('dirs', nargs='+', type=Path, help='export directories of the shards')
+    merge_parser.add_argument('--out_dir', help='output directory', default=argparse.SUPPRESS)
+    verify_parser = subparsers.add_parser('verify', help='check that .eln archives are complete and intact')
+    verify_parser.add_argument('paths', nargs='+', type=Path, help='.eln archives or export directories')
+    verify_parser.add_argument(
+        '--jobs',
+        type=int,
+        help='number of processes checking the archives (default: number of cpus)',
+        default=argparse.SUPPRESS,
+    )
     args = parser.parse_args()
 
-    if args.src == 'labfolder':
+    if args.command == 'merge':
+        merge(args.dirs, Path(args.out_dir))
+    elif args.command == 'verify':
+        if not verify(args.paths, args.jobs):
+            sys.exit(1)
+    elif args.src is None:
+        parser.error('the following arguments are required: --src')
+    elif args.src == 'labfolder':
         server = os.getenv('LABFOLDER_SERVER', 'eln.labfolder.com')
         username = env_or_ask('LABFOLDER_USERNAME', 'Your Labfolder username or email: ')
         password = env_or_ask('LABFOLDER_PASSWORD', 'Your Labfolder password: ')
-        lf = Labfolder(server, username, password, out_dir=args.out_dir)
+        lf = Labfolder(
+            server,
+            username,
+            password,
+            out_dir=args.out_dir,
+            workers=args.workers,
+            stream_zip=args.stream_zip,
+            resume_dir=args.resume,
+            page_size=args.page_size,
+            blob_store=args.blob_store,
+            since_dir=args.since,
+            http_cache=args.http_cache,
+            http_cache_size=args.http_cache_size,
+            http_cache_offline=args.http_cache_offline,
+            jobs=args.jobs,
+            shard=args.shard,
+            shard_by=args.shard_by,
+            progress_interval=args.progress_interval,
+            segment_threshold=args.segment_threshold,
+            segments=args.segments,
+        )
         lf.extract()
     else:
         print('Not implemented.')
@@ -6,36 +6,111 @@
 # use the extract() method
 
 import hashlib
-import shutil
 import json
+import multiprocessing
 import os
+import shutil
 import sys
+import threading
+import time
+from contextlib import nullcontext
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
 from datetime import datetime
 from pathlib import Path
-import random
-from typing import Any
-from itertools import groupby
+from typing import IO, Any, Iterable, Iterator
+from itertools import batched, chain
 
 import requests
 from tqdm import tqdm
-import pandas as pd
 from typing_extensions import TypedDict
-from any2eln.utils.utils import debug
-from any2eln.utils.rocrate import get_crate_metadata
+from any2eln.labfolder.scripts import write_import_scripts
+from any2eln.utils.artifacts import CHUNK_SIZE, write_chunks
+from any2eln.utils.blobs import BlobStore
+from any2eln.utils.cache import CachedResponse, ResponseCache
+from any2eln.utils.eln import DirectoryWriter, ZipWriter, is_compressed, pack_eln
+from any2eln.utils.http import RequestScheduler, get_session
+from any2eln.utils.journal import Journal
+from any2eln.utils.metrics import Metrics, ProgressReporter, timed
+from any2eln.utils.tables import get_sheets, write_csv
+from any2eln.utils.utils import debug, ordered_map, read_jsonl
+from any2eln.utils.rocrate import CrateBuilder
 
 
 class Labfolder:
-    def __init__(self, server: str, username: str, password: str, out_dir='.'):
+    def __init__(
+        self,
+        server: str,
+        username: str,
+        password: str,
+        out_dir='.',
+        workers=4,
+        stream_zip=False,
+        resume_dir=None,
+        page_size=100,
+        blob_store=None,
+        since_dir=None,
+        http_cache=None,
+        http_cache_size=1024,
+        http_cache_offline=False,
+        jobs=None,
+        shard=None,
+        shard_by='author',
+        progress_interval=None,
+        segment_threshold=100,
+        segments=4,
+    ):
         self.server = server
         # TODO: check for empty server
+        # https is implied, but a scheme can be given, for instance to use a local server
+        self.base_url = server if '://' in server else f'https://{server}'
         self.username = username
         self.password = password
+        # number of elements downloaded concurrently
+        self.workers = workers
+        # number of processes packing the archives, defaults to the number of cpus
+        self.jobs = jobs
+        # timings and counters of the export, written in metrics.json
+        self.metrics = Metrics()
+        # print a progress line every this many seconds instead of the progress bars
+        self.progress_interval = progress_interval
+        # all requests go through the scheduler, with a shared keep-alive connection pool
+        # each worker can be downloading a big file in several segments at the same time
+        connections = workers * max(1, segments)
+        self.scheduler = RequestScheduler(
+            get_session(connections), connections, metrics=self.metrics, initial_concurrency=workers
+        )
+        self.token_lock = threading.Lock()
         self.token = self.__get_token()
         # number of entries to get in a request
-        self.chunk_size = 100
+        self.chunk_size = page_size
         # output directory
         self.out_dir = out_dir
-        self.categories = []
+        # write the .eln archives directly instead of zipping a staging directory
+        self.stream_zip = stream_zip
+        # a previous export directory to resume
+        self.resume_dir = resume_dir
+        # (index, count) to only export a part of the account, index starts at 1
+        self.shard = shard
+        # split the shards by 'author' or by 'entry'
+        self.shard_by = shard_by
+        # a previous export, to only get what changed since then
+        self.since_dir = since_dir
+        # keep the element responses on disk for the next runs, size is in MB
+        self.cache = (
+            ResponseCache(Path(http_cache), http_cache_size * 1024 * 1024, http_cache_offline)
+            if http_cache is not None
+            else None
+        )
+        # store payloads by content so they are downloaded and stored only once
+        self.blobs = BlobStore(Path(blob_store)) if blob_store is not None else None
+        # files bigger than this many MB are downloaded in several parts at the same time
+        self.segment_threshold = segment_threshold * 1024 * 1024
+        self.segments = segments
+        # where the parts are kept until the file is complete, set by extract()
+        self.parts_dir = Path('.parts')
+        self.parts_lock = threading.Lock()
+        # the project titles, as an ordered set
+        self.categories: dict[str, None] = {}
 
     def __get_token(self):
         """Generate a token. See https://eln.labfolder.com/api/v2/docs/development.html#access-endpoints"""
@@ -44,63 +119,160 @@ class Labfolder:
             return os.getenv('LABFOLDER_TOKEN')
 
         # token is not present in env, so get it from auth/login api
-        url = "https://" + self.server + "/api/v2/auth/login"
+        url = self.base_url + "/api/v2/auth/login"
         headers = {'Content-Type': 'application/json'}
         data = {
             'user': self.username,
             'password': self.password,
         }
         try:
-            response = requests.post(url, headers=headers, data=json.dumps(data))
+            response = self.scheduler.request('POST', url, headers=headers, data=json.dumps(data), metric='login')
             response.raise_for_status()
         except requests.exceptions.RequestException as e:
             print(f'Error getting token: {e}')
             sys.exit(1)
         return response.json()['token']
 
-    def __get_entries(self):
-        # we first make a limited query to get the total number of entries
-        first = self.__get_entries_chunk(0, 1)
+    def __api_get(self, url: str, headers: dict[str, str] | None = None, **kwargs) -> requests.Response:
+        """GET an api endpoint, logging in again if the token has expired"""
+        headers = headers or {}
+        token = self.token
+        response = self.scheduler.request('GET', url, headers={**headers, 'Authorization': f'Bearer {token}'}, **kwargs)
+        if response.status_code == 401 and os.getenv('LABFOLDER_TOKEN') is None:
+            response.close()
+            with self.token_lock:
+                # another thread might have done it already
+                if self.token == token:
+                    debug('Token expired, logging in again')
+                    self.token = self.__get_token()
+            headers['Authorization'] = f'Bearer {self.token}'
+            response = self.scheduler.request('GET', url, headers=headers, **kwargs)
+        return response
+
+    def __get_entries(self) -> Iterator[dict[str, Any]]:
+        """Yield the entries page by page, as they are received"""
+        # the first page also gives us the total number of entries
+        first = self.__get_entries_chunk(0, self.chunk_size)
         # it is stored in the x-total-count response header
         total_count = int(first.headers.get('x-total-count'))
         print(f'Found {total_count} entries')
-        chunk_number = total_count // self.chunk_size
-        debug(f'Number of chunks: {chunk_number}')
-        entries = []
-        for i in range(chunk_number + 1):
-            offset = i * self.chunk_size
-            entries.extend(self.__get_entries_chunk(offset).json())
-        return entries
-
-    def __get_entries_chunk(self, offset: int, limit=100):
-        url = 'https://' + self.server + '/api/v2/entries'
-        headers = {'Authorization': f'Bearer {self.token}'}
-        params = {'expand': 'author,project,last_editor', 'limit': limit, 'offset': offset}
+        # the other pages are fetched concurrently, but they are still yielded in order
+        offsets = range(self.chunk_size, total_count, self.chunk_size)
+        debug(f'Number of chunks: {len(offsets) + 1}')
+        # entries created during the listing shift the pages, so the same entry can show up twice
+        seen: set[str] = set()
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            pages = ordered_map(
+                executor, lambda offset: self.__get_entries_chunk(offset, self.chunk_size), offsets, self.workers * 2
+            )
+            page = []
+            for response in chain([first], pages):
+                page = response.json()
+                yield from self.__get_unseen(page, seen)
+        # and they can push some entries past the last page we planned, so continue until a page is not full
+        offset = (offsets[-1] if offsets else 0) + self.chunk_size
+        while len(page) == self.chunk_size:
+            page = self.__get_entries_chunk(offset, self.chunk_size).json()
+            yield from self.__get_unseen(page, seen)
+            offset += self.chunk_size
+        if len(seen) != total_count:
+            print(f'Entries changed during the listing, got {len(seen)} entries')
+
+    def __get_unseen(self, page: list[dict[str, Any]], seen: set[str]) -> Iterator[dict[str, Any]]:
+        for entry in page:
+            if entry['id'] not in seen:
+                seen.add(entry['id'])
+                yield entry
+
+    def __spill_entries(self, entries: Iterable[dict[str, Any]], entries_dir: Path) -> dict[Any, int]:
+        """Split the entries in one file per author, so the whole account never sits in memory.
+        Returns the number of entries for each author."""
+        # start from scratch, a resumed export lists the entries again
+        shutil.rmtree(entries_dir, ignore_errors=True)
+        entries_dir.mkdir()
+        counts: dict[Any, int] = {}
+        for page in batched(entries, self.chunk_size):
+            by_author: dict[Any, list[dict[str, Any]]] = {}
+            for entry in page:
+                by_author.setdefault(entry['author_id'], []).append(entry)
+            for author, author_entries in by_author.items():
+                with entries_dir.joinpath(f'author-{author}.jsonl').open('a') as file:
+                    file.writelines(json.dumps(entry) + '\n' for entry in author_entries)
+                counts[author] = counts.get(author, 0) + len(author_entries)
+        return counts
+
+    def __in_shard(self, record: dict[str, Any]) -> bool:
+        """Check if an entry, or its record in a manifest, belongs to the shard we export"""
+        if self.shard is None:
+            return True
+        index, count = self.shard
+        key = record['author_id'] if self.shard_by == 'author' else record['id']
+        # python's hash() changes between runs, and all the nodes must agree
+        return int(hashlib.sha1(str(key).encode()).hexdigest(), 16) % count == index - 1
+
+    def __write_manifest_record(self, entry: dict[str, Any], manifest: IO[str]) -> None:
+        """Record the id, author and version date of an entry, so the next export can skip it if it doesn't change"""
+        record = {'id': entry['id'], 'author_id': entry['author_id'], 'version_date': entry['version_date']}
+        manifest.write(json.dumps(record) + '\n')
+
+    def __get_changed(
+        self, entries: Iterable[dict[str, Any]], since_dir: Path, main_dir: Path, manifest: IO[str]
+    ) -> Iterator[dict[str, Any]]:
+        """Only keep the entries that are new or were modified since a previous export, and list the deleted ones.
+        The unchanged entries are carried over to the new manifest."""
+        previous = {
+            record['id']: record
+            for record in read_jsonl(since_dir.joinpath('manifest.jsonl'))
+            if self.__in_shard(record)
+        }
+        changed = 0
+        for entry in entries:
+            before = previous.pop(entry['id'], None)
+            if before is None or before['version_date'] != entry['version_date']:
+                changed += 1
+                yield entry
+            else:
+                self.__write_manifest_record(entry, manifest)
+        # what is left was not listed this time
+        with main_dir.joinpath('deleted-entries.json').open('w') as file:
+            json.dump(list(previous.values()), file, indent=2)
+        print(f'{changed} entries are new or modified and {len(previous)} were deleted since {since_dir}')
+
+    def __save_entries(self, entries: Iterable[dict[str, Any]]) -> Iterator[dict[str, Any]]:
+        """Write the entries in entries.json while they go through"""
+        with open('entries.json', 'w') as file:
+            file.write('[')
+            for i, entry in enumerate(entries):
+                file.write((',\n' if i else '\n') + json.dumps(entry, indent=2))
+                yield entry
+            file.write('\n]\n')
+
+    def __get_entries_chunk(self, offset: int, limit: int):
+        url = self.base_url + '/api/v2/entries'
+        params: dict[str, str | int] = {'expand': 'author,project,last_editor', 'limit': limit, 'offset': offset}
         try:
-            response = requests.get(url, headers=headers, params=params)
+            response = self.__api_get(url, params=params, metric='entries')
             response.raise_for_status()
         except requests.exceptions.RequestException as e:
             print(f'Error getting entries: {e}')
             sys.exit(1)
         return response
 
-    def __get_unique_enough_id(self) -> str:
-        return random.randbytes(20).hex()
+    def __get_csv_id(self, element_id: str, sheet_name: str) -> str:
+        # derived from the element so a resumed export overwrites the same file instead of leaving an orphan
+        return hashlib.sha1(f'{element_id}/{sheet_name}'.encode()).hexdigest()
 
-    def __get_node_from_csv(self, csv_id: str, csv: tuple[str, str], entry_folder: Path):
+    def __get_node_from_csv(self, csv_id: str, csv_name: str, entry_id: str):
         node: dict[str, Any] = {}
-        node['@id'] = f"./{entry_folder.name}/{csv_id}"
+        node['@id'] = f"./{entry_id}/{csv_id}"
         node['@type'] = 'File'
-        node['name'] = csv[0]
-        contentSize = len(csv[1].encode())
-        if contentSize > 0:
-            node['contentSize'] = contentSize
+        node['name'] = csv_name
         node['encodingFormat'] = 'text/csv'
         return node
 
-    def __get_node_from_metadata(self, json: dict[str, Any], entry_folder: Path):
+    def __get_node_from_metadata(self, json: dict[str, Any], entry_id: str):
         node: dict[str, Any] = {}
-        node['@id'] = f"./{entry_folder.name}/{json.get('id')}"
+        node['@id'] = f"./{entry_id}/{json.get('id')}"
         node['@type'] = 'File'
         node['name'] = json.get('file_name') or json.get('title') or 'Unknown'
         contentSize = int(json.get('file_size', 0))
@@ -110,6 +282,40 @@ class Labfolder:
         return node
 
     def extract(self) -> Path:
+        progress = ProgressReporter(self.metrics, self.progress_interval) if self.progress_interval else nullcontext()
+        with progress, self.metrics.phase('total'):
+            main_dir = self.__extract()
+        # so a slow export can be explained after the fact
+        self.metrics.write(main_dir.joinpath('metrics.json'))
+        return main_dir
+
+    def __extract(self) -> Path:
+        if self.since_dir is not None and not Path(self.since_dir).joinpath('manifest.jsonl').exists():
+            print(f'Error: no manifest.jsonl found in {self.since_dir}')
+            sys.exit(1)
+
+        # this will hold a little summary with the author id and their name and email
+        summary = ''
+
+        # define a type for the node with @id = ./
+        SelfNode = TypedDict('SelfNode', {'@id': str, '@type': str, 'hasPart': list[dict[str, str]]})
+
+        if self.resume_dir is not None:
+            main_dir = Path(self.resume_dir).resolve()
+            print(f'Resuming export in {main_dir}')
+        else:
+            now = datetime.now().strftime('%Y-%m-%d-%H-%M-%S')
+            shard = f'-shard-{self.shard[0]}-of-{self.shard[1]}' if self.shard is not None else ''
+            main_dir = Path(self.out_dir).joinpath(f'export-{now}{shard}').resolve()
+            main_dir.mkdir()
+            print(f'Exporting to {main_dir}, use --resume {main_dir} if it gets interrupted')
+        # the journal keeps track of what is already saved so we can resume an export
+        journal_dir = main_dir.joinpath('.journal')
+        journal_dir.mkdir(exist_ok=True)
+        # the parts of unfinished segmented downloads, they are picked up again on resume
+        self.parts_dir = main_dir.joinpath('.parts')
+
+        entries: Iterable[dict[str, Any]]
         if os.getenv('USE_LOCAL') == '1':
             local_file = 'entries.json'
             print(f'Using local file: {local_file}')
@@ -118,145 +324,117 @@ class Labfolder:
         else:
             entries = self.__get_entries()
             if os.getenv('SAVE_ENTRIES') == '1':
-                with open('entries.json', 'w') as file:
-                    json.dump(entries, file, indent=2)
+                entries = self.__save_entries(entries)
+        if self.shard is not None:
+            entries = (entry for entry in entries if self.__in_shard(entry))
+        # the manifest lists the entries that were fully saved, so the next export can only get what changed since
+        # this one, and what could not be saved this time
+        manifest = main_dir.joinpath('manifest.jsonl').open('w')
+        if self.since_dir is not None:
+            entries = self.__get_changed(entries, Path(self.since_dir), main_dir, manifest)
         # we're going to split the entries based on the author_id value, and generate a .eln for each author
-        sorted_entries = sorted(entries, key=lambda e: e['author_id'])
-        entries_by_author = {key: list(group) for key, group in groupby(sorted_entries, key=lambda e: e['author_id'])}
-        if os.getenv('SAVE_ENTRIES') == '1':
-            with open('entries-sorted.json', 'w') as file:
-                json.dump(entries_by_author, file, indent=2)
-
-        # this will hold a little summary with the author id and their name and email
-        summary = ''
-
-        # define a type for the node with @id = ./
-        SelfNode = TypedDict('SelfNode', {'@id': str, '@type': str, 'hasPart': list[dict[str, str]]})
-
-        now = datetime.now().strftime('%Y-%m-%d-%H-%M-%S')
-        main_dir = Path(self.out_dir).joinpath(f'export-{now}').resolve()
-        main_dir.mkdir()
-
-        with tqdm(total=len(entries_by_author)) as superpbar:
-            for author, author_entries in entries_by_author.items():
+        entries_dir = main_dir.joinpath('.entries')
+        with self.metrics.phase('listing'):
+            entries_count = self.__spill_entries(entries, entries_dir)
+        self.metrics.entries_total = sum(entries_count.values())
+
+        # zipping is cpu bound, so staging directories are packed in other processes while we download the next authors
+        packing: list[tuple[Future[tuple[Path, float]], Path, bool]] = []
+        # the progress line replaces the bars, they are unreadable in logs
+        no_bars = self.progress_interval is not None
+        with (
+            ThreadPoolExecutor(max_workers=self.workers) as executor,
+            ProcessPoolExecutor(max_workers=self.jobs, mp_context=multiprocessing.get_context('spawn')) as packers,
+            tqdm(total=len(entries_count), disable=no_bars) as superpbar,
+        ):
+            extraction_start = time.monotonic()
+            for author in sorted(entries_count):
+                author_start = time.monotonic()
+                author_totals = {'entries': 0, 'elements': 0, 'resumed': 0, 'skipped': 0, 'bytes': 0}
                 debug(f'Processing author: {author}')
+                entries_file = entries_dir.joinpath(f'author-{author}.jsonl')
 
-                crate_metadata = get_crate_metadata()
                 # the @id = ./ node
                 self_node: SelfNode = {'@id': './', '@type': 'Dataset', 'hasPart': []}
 
-                author_dir = main_dir.joinpath(f'author-{author}')
-                author_dir.mkdir()
-
-                with tqdm(total=len(author_entries)) as pbar:
-                    for entry in author_entries:
+                # when split by entries, the archive of an author is made by several shards
+                suffix = f'-shard-{self.shard[0]}' if self.shard is not None and self.shard_by == 'entry' else ''
+                eln_name = main_dir.joinpath(f'author-{author}{suffix}.eln')
+                journal = Journal(journal_dir.joinpath(f'author-{author}.jsonl'))
+                # the archive is already there, the graph is rebuilt from the journal only for the summary
+                # an author is never marked done while some of its elements failed, so they are tried again
+                done = journal.done and not journal.failed and eln_name.exists()
+                if not done and journal.failed:
+                    print(f'Trying again {len(journal.failed)} elements that failed for author {author}')
+                # the graph is written on disk as it grows, and added to the archive at the end
+                crate_path = journal_dir.joinpath(f'author-{author}-ro-crate-metadata.json')
+                crate = CrateBuilder(None if done else crate_path.open('wb'))
+                if not done:
+                    if self.stream_zip:
+                        # an unfinished zip cannot be reopened, so files recorded in the journal are lost
+                        journal.reset()
+                    writer = ZipWriter(eln_name) if self.stream_zip else DirectoryWriter(eln_name)
+
+                # elements of all the entries are downloaded concurrently, but results come back in order
+                # so the graph is always built the same way
+                # the journal grows while the jobs are generated ahead, so both sides skip from the same snapshot
+                saved = set(journal.elements)
+                jobs = (
+                    (element, entry['id'], writer)
+                    for entry in read_jsonl(entries_file)
+                    for element in entry['elements']
+                    if not done and self.__get_element_key(element) not in saved
+                )
+                results = ordered_map(executor, lambda job: self.__extract_element(*job), jobs, self.workers * 4)
+
+                with tqdm(total=entries_count[author], disable=no_bars) as pbar:
+                    for entry in read_jsonl(entries_file):
                         debug(f"Extracting entry with ID: {entry['id']}")
-                        entry_folder = author_dir.joinpath(entry['id'])
-                        entry_folder.mkdir()
+                        if not done:
+                            writer.mkdir(entry['id'])
                         content = []
                         files = []
+                        complete = True
 
                         for element in entry['elements']:
-                            debug(f"Processing {element.get('type')} with ID: {element['id']}")
-                            # see https://eln.labfolder.com/api/v2/docs/development.html#entry-elements-file-elements-get
-                            if element['type'] == 'FILE':
-                                # get the json first so we can grab the name
-                                res = self.__get_element(element)
-                                if res is None:
-                                    continue
-                                json_metadata = res.json()
-                                node = self.__get_node_from_metadata(json_metadata, entry_folder)
-                                with entry_folder.joinpath(f"{element['id']}.json").open('w') as json_file:
-                                    json.dump(json_metadata, json_file, indent=4)
-                                # now get original data, the image itself
-                                res = self.__get_element(element, True)
-                                # might throw error 400 if element has nothing to download
-                                if res is None:
-                                    continue
-                                with entry_folder.joinpath(element['id']).open('wb') as file:
-                                    file.write(res.content)
-                                node['sha256'] = hashlib.sha256(res.content).hexdigest()
-                                crate_metadata['@graph'].append(node)
-                                files.append(node['@id'])
-
-                            if element['type'] == 'IMAGE':
-                                # get the json first
-                                res = self.__get_element(element)
-                                if res is None:
-                                    continue
-                                json_metadata = res.json()
-                                node = self.__get_node_from_metadata(json_metadata, entry_folder)
-                                with entry_folder.joinpath(f"{element['id']}.json").open('w') as json_file:
-                                    json.dump(json_metadata, json_file, indent=2)
-                                # now get original data, the image itself
-                                res = self.__get_element(element, True)
-                                with entry_folder.joinpath(element['id']).open('wb') as file:
-                                    file.write(res.content)
-                                node['sha256'] = hashlib.sha256(res.content).hexdigest()
-                                crate_metadata['@graph'].append(node)
-                                files.append(node['@id'])
-
-                            # for TABLE we try and save each sheet as a csv but also keep the full json around as a json file
-                            # a WELL_PLATE has the same structure as a TABLE, so we can use the same code
-                            if element['type'] == 'TABLE' or element['type'] == 'WELL_PLATE':
-                                res = self.__get_element(element)
-                                if res is None:
+                            key = self.__get_element_key(element)
+                            if key in saved:
+                                nodes, text = journal.elements[key]['nodes'], journal.elements[key]['text']
+                                author_totals['resumed'] += 1
+                            elif done:
+                                # this element failed in the previous run
+                                complete = False
+                                continue
+                            else:
+                                result = next(results)
+                                if result is None:
+                                    complete = False
+                                    journal.add_failed(key)
+                                    author_totals['skipped'] += 1
+                                    self.metrics.count('elements.skipped')
                                     continue
-                                json_metadata = res.json()
-                                node = self.__get_node_from_metadata(json_metadata, entry_folder)
-                                # save the full json
-                                with entry_folder.joinpath(f"{json_metadata['id']}").open('w') as json_file:
-                                    json.dump(json_metadata, json_file, indent=2)
-                                node['sha256'] = hashlib.sha256(
-                                    json.dumps(json_metadata, indent=2).encode()
-                                ).hexdigest()
-                                crate_metadata['@graph'].append(node)
+                                nodes, text = result
+                                journal.add_element(key, nodes, text)
+                                author_totals['elements'] += 1
+                                author_totals['bytes'] += sum(node.get('contentSize', 0) for node in nodes)
+                                self.metrics.count('elements.saved')
+                            for node in nodes:
+                                crate.add(node)
                                 files.append(node['@id'])
+                            if text is not None:
+                                content.append(text)
 
-                                # now save sheets as csv files
-                                csvs = self.__get_csvs_from_json(json_metadata)
-                                for csv in csvs:
-                                    # get an id so we can store it without clashes
-                                    csv_id = self.__get_unique_enough_id()
-                                    node = self.__get_node_from_csv(csv_id, csv, entry_folder)
-                                    with entry_folder.joinpath(csv_id).open('w') as file:
-                                        file.write(csv[1])
-                                    node['sha256'] = hashlib.sha256(csv[1].encode()).hexdigest()
-                                    crate_metadata['@graph'].append(node)
-                                    files.append(node['@id'])
-
-                            # for this element type we simply store the json for now
-                            if element['type'] == 'DATA':
-                                res = self.__get_element(element)
-                                if res is None:
-                                    continue
-                                json_metadata = res.json()
-                                node = self.__get_node_from_metadata(json_metadata, entry_folder)
-                                with entry_folder.joinpath(f"{json_metadata['id']}").open('w') as json_file:
-                                    json.dump(json_metadata, json_file, indent=2)
-                                node['sha256'] = hashlib.sha256(
-                                    json.dumps(json_metadata, indent=2).encode()
-                                ).hexdigest()
-                                crate_metadata['@graph'].append(node)
-                                files.append(node['@id'])
-
-                            if element['type'] == 'TEXT':
-                                res = self.__get_element(element)
-                                if res is None:
-                                    continue
-                                json_metadata = res.json()
-                                with entry_folder.joinpath(f"{json_metadata['id']}.json").open('w') as json_file:
-                                    json.dump(json_metadata, json_file, indent=2)
-                                content.append(json_metadata['content'])
-
+                        if complete:
+                            self.__write_manifest_record(entry, manifest)
                         pbar.update(1)
+                        author_totals['entries'] += 1
+                        self.metrics.count('entries.done')
 
                         # create the Dataset node
-                        crate_metadata['@graph'].append(self.__get_dataset_node(entry, content, files))
+                        crate.add(self.__get_dataset_node(entry, content, files))
                         # add the author node only if it doesn't exist already
                         author_node = self.__get_author_node(entry)
-                        if author_node not in crate_metadata['@graph']:
-                            crate_metadata['@graph'].append(author_node)
+                        if crate.add(author_node):
                             summary += f"\n{author_node.get('@id')} | {author_node.get('familyName')} | {author_node.get('givenName')} | {author_node.get('email')}"
                         self_node['hasPart'].append({'@id': f"./{entry['id']}"})
 
@@ -264,78 +442,281 @@ class Labfolder:
                 # end tqdm loop
 
                 # add the self node now that it has all the hasPart
-                crate_metadata['@graph'].append(self_node)
-
-                with author_dir.joinpath('ro-crate-metadata.json').open('w') as json_file:
-                    json.dump(crate_metadata, json_file, indent=2)
-
-                # create a container directory because shutil will gobble up the folder
-                container = main_dir.joinpath(f'{author_dir.name}-container')
-                container.mkdir()
-                author_dir.rename(container.joinpath(author_dir.name))
-                eln_name = main_dir.joinpath(f'{author_dir.name}.eln')
-                eln_zip = shutil.make_archive(eln_name, 'zip', container)
-                # shutil will add a .zip extension but we want a .eln
-                Path(eln_zip).rename(eln_name)
-                print(f'Created {eln_name}')
+                crate.add(dict(self_node))
+                crate.close()
+
+                if not done:
+                    # the metadata file is written last, when all the files are in
+                    writer.add_file('ro-crate-metadata.json', crate_path)
+                    crate_path.unlink()
+                    if isinstance(writer, DirectoryWriter):
+                        future = packers.submit(timed, pack_eln, writer.root, writer.eln_path)
+                        packing.append((future, journal.path, not journal.failed))
+                    else:
+                        with self.metrics.timer('zip'):
+                            eln_path = writer.close()
+                        print(f'Created {eln_path}')
+                        if not journal.failed:
+                            journal.mark_done()
+                    if journal.failed:
+                        print(f'{eln_name.name} is missing {len(journal.failed)} elements, use --resume to try again')
+                journal.close()
+                self.metrics.count('elements.resumed', author_totals['resumed'])
+                self.metrics.add_author(author, seconds=time.monotonic() - author_start, **author_totals)
                 superpbar.update(1)
+            self.metrics.add_phase('extraction', time.monotonic() - extraction_start)
+            # the entries are listed again on resume, and the copy holds names and emails of the authors
+            shutil.rmtree(entries_dir)
+
+            # wait for all the archives to be packed
+            with self.metrics.phase('packing'):
+                for future, journal_path, complete in packing:
+                    eln_path, seconds = future.result()
+                    self.metrics.add_time('zip', seconds)
+                    print(f'Created {eln_path}')
+                    if complete:
+                        journal = Journal(journal_path, load=False)
+                        journal.mark_done()
+                        journal.close()
+        manifest.close()
 
         # write the summary.txt file with authors names
         with main_dir.joinpath('summary.txt').open('w') as file:
             file.write(summary)
 
-        # create a script so we can create the Projects and then link experiments with same tag to them
-        with main_dir.joinpath('create-projects.py').open('w') as file:
-            file.write(self.__get_project_script())
-        # create a sql script to make links from experiments to projects
-        with main_dir.joinpath('create-links.sql').open('w') as file:
-            file.write(self.__get_links_script())
+        # keep the categories around so the exports of several shards can be merged
+        with main_dir.joinpath('categories.json').open('w') as file:
+            json.dump(list(self.categories), file, indent=2)
+        write_import_scripts(main_dir, self.categories)
+
+        if self.blobs is not None:
+            print(self.blobs.get_report())
+            self.blobs.close()
         return main_dir
 
-    def __get_links_script(self) -> str:
-        lines = []
-        for category in self.categories:
-            lines.append(f"""
-INSERT INTO experiments_links (item_id, link_id)
-SELECT
-  experiments.id,
-  (SELECT items.id FROM items WHERE title = "{category}" LIMIT 1)
-FROM experiments
-LEFT JOIN tags2entity ON tags2entity.item_id = experiments.id AND tags2entity.item_type = 'experiments'
-LEFT JOIN tags ON tags2entity.tag_id = tags.id
-WHERE tags.tag = "{category}";""")
-        return '\n'.join(lines)
-
-    def __get_project_script(self) -> str:
-        header = """#!/usr/bin/env python
-import elabapi_python
-API_HOST_URL = 'https://elab.local:3148/api/v2'
-API_KEY = 'apiKey4Test'
-configuration = elabapi_python.Configuration()
-configuration.api_key['api_key'] = API_KEY
-configuration.api_key_prefix['api_key'] = 'Authorization'
-configuration.host = API_HOST_URL
-configuration.debug = False
-configuration.verify_ssl = False
-api_client = elabapi_python.ApiClient(configuration)
-api_client.set_default_header(header_name='Authorization', header_value=API_KEY)
-itemsTypesApi = elabapi_python.ItemsTypesApi(api_client)
-response = itemsTypesApi.post_items_types_with_http_info(body={'title': "Projects"})
-locationHeaderInResponse = response[2].get('Location')
-projects_cat_id = int(locationHeaderInResponse.split('=').pop())
-itemsApi = elabapi_python.ItemsApi(api_client)
-"""
-
-        body = map(self.__to_post_action, self.categories)
-        return header + '\n'.join(body)
-
-    def __to_post_action(self, category: str) -> str:
-        s = """
-response = itemsApi.post_item_with_http_info(body={'category_id': projects_cat_id})
-locationHeaderInResponse = response[2].get('Location')
-itemId = int(locationHeaderInResponse.split('/').pop())
-itemsApi.patch_item(itemId, body={'title': """
-        return f'{s}"{category}"' + '})'
+    def __extract_element(
+        self, element: dict[str, Any], entry_id: str, writer: DirectoryWriter | ZipWriter
+    ) -> tuple[list[dict[str, Any]], str | None] | None:
+        """Save an element in the entry folder. Returns the File nodes to add to the graph and the text content if any.
+        None is returned if the element could not be saved."""
+        nodes: list[dict[str, Any]] = []
+        debug(f"Processing {element.get('type')} with ID: {element['id']}")
+        # see https://eln.labfolder.com/api/v2/docs/development.html#entry-elements-file-elements-get
+        if element['type'] == 'FILE' or element['type'] == 'IMAGE':
+            # get the json first so we can grab the name
+            res = self.__get_element(element)
+            if res is None:
+                return None
+            json_metadata = res.json()
+            node = self.__get_node_from_metadata(json_metadata, entry_id)
+            with writer.open(f"{entry_id}/{element['id']}.json") as json_file:
+                json_file.write(json.dumps(json_metadata, indent=2).encode())
+            # now get original data, the file or image itself
+            fields = self.__download(element, f"{entry_id}/{element['id']}", writer, json_metadata)
+            if fields is None:
+                return None
+            node.update(fields)
+            nodes.append(node)
+
+        # for TABLE we try and save each sheet as a csv but also keep the full json around as a json file
+        # a WELL_PLATE has the same structure as a TABLE, so we can use the same code
+        if element['type'] == 'TABLE' or element['type'] == 'WELL_PLATE':
+            res = self.__get_element(element)
+            if res is None:
+                return None
+            json_metadata = res.json()
+            node = self.__get_node_from_metadata(json_metadata, entry_id)
+            # save the full json
+            with writer.open(f"{entry_id}/{json_metadata['id']}") as json_file:
+                node.update(write_chunks(json_file, [json.dumps(json_metadata, indent=2).encode()]))
+            nodes.append(node)
+
+            # now save sheets as csv files
+            for sheet_name, table_data in get_sheets(json_metadata):
+                csv_name = sheet_name + '.csv'
+                # get an id so we can store it without clashes
+                csv_id = self.__get_csv_id(json_metadata['id'], csv_name)
+                node = self.__get_node_from_csv(csv_id, csv_name, entry_id)
+                with self.metrics.timer('csv'), writer.open(f'{entry_id}/{csv_id}') as file:
+                    node.update(write_csv(file, table_data))
+                nodes.append(node)
+
+        # for this element type we simply store the json for now
+        if element['type'] == 'DATA':
+            res = self.__get_element(element)
+            if res is None:
+                return None
+            json_metadata = res.json()
+            node = self.__get_node_from_metadata(json_metadata, entry_id)
+            with writer.open(f"{entry_id}/{json_metadata['id']}") as json_file:
+                node.update(write_chunks(json_file, [json.dumps(json_metadata, indent=2).encode()]))
+            nodes.append(node)
+
+        if element['type'] == 'TEXT':
+            res = self.__get_element(element)
+            if res is None:
+                return None
+            json_metadata = res.json()
+            with writer.open(f"{entry_id}/{json_metadata['id']}.json") as json_file:
+                json_file.write(json.dumps(json_metadata, indent=2).encode())
+            return nodes, json_metadata['content']
+        return nodes, None
+
+    def __download(
+        self, element: dict[str, Any], name: str, writer: DirectoryWriter | ZipWriter, json_metadata: dict[str, Any]
+    ) -> dict[str, Any] | None:
+        """Stream the payload of an element to the archive, starting over if the connection breaks midway"""
+        content_type = json_metadata.get('content_type') or json_metadata.get('original_file_content_type')
+        compress = not is_compressed(content_type)
+        # the same element with the same size is assumed to have the same content
+        blob_key = f"{self.__get_element_key(element)}-{json_metadata.get('file_size', '')}"
+        if self.blobs is not None:
+            blob = self.blobs.get(blob_key)
+            if blob is not None:
+                self.metrics.count('blobs.reused')
+                writer.add_file(name, blob[0], compress)
+                return blob[1]
+        size = int(json_metadata.get('file_size') or 0)
+        offline = self.cache is not None and self.cache.offline
+        if (
+            element['type'] == 'FILE'
+            and self.segments > 1
+            and size > 0
+            and size >= self.segment_threshold
+            and not offline
+        ):
+            parts = self.__download_segments(element, size)
+            if parts is None:
+                return None
+            if parts:
+                with self.metrics.timer('write'):
+                    if self.blobs is None:
+                        with writer.open(name, compress) as file:
+                            fields = write_chunks(file, self.__read_parts(parts))
+                    else:
+                        path, fields = self.blobs.add(blob_key, self.__read_parts(parts))
+                        writer.add_file(name, path, compress)
+                shutil.rmtree(parts[0].parent)
+                return fields
+            # the server ignores Range, so download it in one go
+        for attempt in range(self.scheduler.retries + 1):
+            try:
+                res = self.__get_element(element, True)
+                # might throw error 400 if element has nothing to download
+                if res is None:
+                    return None
+                with res:
+                    # waiting on the network is timed apart from hashing and writing
+                    chunks = self.metrics.measure(res.iter_content(CHUNK_SIZE), 'download', 'write')
+                    if self.blobs is None:
+                        with writer.open(name, compress) as file:
+                            return write_chunks(file, chunks)
+                    path, fields = self.blobs.add(blob_key, chunks)
+                    writer.add_file(name, path, compress)
+                    return fields
+            except requests.exceptions.RequestException as e:
+                print(f'Error downloading element: {e}')
+                self.metrics.count('downloads.restarted')
+                if attempt < self.scheduler.retries:
+                    self.scheduler.wait(attempt)
+        return None
+
+    def __download_segments(self, element: dict[str, Any], size: int) -> list[Path] | None:
+        """Download a big file as several Range requests at the same time, each one in its own part file.
+        Returns the part files in order, an empty list if the server does not support Range,
+        or None if a part could not be downloaded. Parts are kept on disk so the download can be resumed."""
+        url = self.__get_element_url(element, True)
+        parts_dir = self.parts_dir.joinpath(f'{self.__get_element_key(element)}-{size}')
+        validator_path = parts_dir.joinpath('validator')
+        if parts_dir.exists() and not validator_path.exists():
+            # without the version of the file they come from, parts of a previous run cannot be trusted
+            shutil.rmtree(parts_dir)
+        parts_dir.mkdir(parents=True, exist_ok=True)
+        segment_size = -(-size // self.segments)
+        bounds = [(start, min(size, start + segment_size)) for start in range(0, size, segment_size)]
+        parts = [parts_dir.joinpath(f'part-{index}') for index in range(len(bounds))]
+        debug(f'Downloading {url} in {len(parts)} segments')
+        with ThreadPoolExecutor(max_workers=len(parts)) as executor:
+            results = list(
+                executor.map(
+                    lambda part: self.__download_segment(url, size, validator_path, part[0], *part[1]),
+                    zip(parts, bounds),
+                )
+            )
+        if False in results:
+            debug(f'No Range support for {url} or the file changed, downloading it in one stream')
+            shutil.rmtree(parts_dir)
+            return []
+        if None in results:
+            return None
+        self.metrics.count('downloads.segmented')
+        return parts
+
+    def __download_segment(
+        self, url: str, size: int, validator_path: Path, path: Path, start: int, end: int
+    ) -> bool | None:
+        """Download bytes from start to end (excluded) in a part file, continuing from what it already has.
+        Returns False if the server ignores the Range header or the file is not the one the other parts come from,
+        and None if all attempts failed."""
+        for attempt in range(self.scheduler.retries + 1):
+            offset = start + (path.stat().st_size if path.exists() else 0)
+            if offset == end:
+                return True
+            if offset > end:
+                # more than asked for was written, there is no telling what is in there
+                path.unlink()
+                continue
+            try:
+                headers = {'Range': f'bytes={offset}-{end - 1}'}
+                if validator_path.exists():
+                    # the server sends the whole file instead of the range if it changed since
+                    headers['If-Range'] = validator_path.read_text()
+                response = self.__api_get(url, headers=headers, stream=True, metric='FILE/download-segment')
+                with response:
+                    if response.status_code == 200:
+                        return False
+                    response.raise_for_status()
+                    # bytes start-end/total, the segments are only right if the file is still the size we expect
+                    content_range = response.headers.get('Content-Range', '')
+                    total = content_range.rpartition('/')[2]
+                    if not content_range.startswith(f'bytes {offset}-') or total != str(size):
+                        return False
+                    if not self.__check_validator(validator_path, response):
+                        return False
+                    chunks = self.metrics.measure(response.iter_content(CHUNK_SIZE), 'download', 'write')
+                    with path.open('ab') as file:
+                        for chunk in chunks:
+                            file.write(chunk)
+            except requests.exceptions.RequestException as e:
+                print(f'Error downloading segment: {e}')
+                self.metrics.count('downloads.restarted')
+                if attempt < self.scheduler.retries:
+                    self.scheduler.wait(attempt)
+        # the last attempt might have completed it
+        if path.exists() and start + path.stat().st_size == end:
+            return True
+        return None
+
+    def __check_validator(self, path: Path, response: requests.Response) -> bool:
+        """Record the version of the file the first segment comes from, and check the other segments match it"""
+        etag = response.headers.get('ETag', '')
+        # a weak etag cannot be used in If-Range
+        validator = etag if etag and not etag.startswith('W/') else response.headers.get('Last-Modified', '')
+        with self.parts_lock:
+            if not path.exists():
+                if validator:
+                    path.write_text(validator)
+                return True
+            return path.read_text() == validator
+
+    def __read_parts(self, parts: list[Path]) -> Iterator[bytes]:
+        for part in parts:
+            with part.open('rb') as file:
+                while chunk := file.read(CHUNK_SIZE):
+                    yield chunk
+
+    def __get_element_key(self, element: dict[str, Any]) -> str:
+        return f"{element['type']}-{element['id']}"
 
     def __get_dataset_node(self, entry: dict[str, Any], content: list[str], files: list[str]):
         node: dict[str, Any] = {}
@@ -349,7 +730,7 @@ itemsApi.patch_item(itemId, body={'title': """
         entry['tags'].append(project_title)
         # and store it in our general list of projects
         if project_title not in self.categories:
-            self.categories.append(project_title)
+            self.categories[project_title] = None
         node['keywords'] = ','.join(entry.get('tags', []))
         # use this to create a Category with the Project title
         # node['category'] = entry.get('project', {}).get('title', {})
@@ -368,56 +749,53 @@ itemsApi.patch_item(itemId, body={'title': """
         node['email'] = author_node['email']
         return node
 
-    def __get_element(self, element: dict[str, Any], get_data=False):
+    def __get_element_url(self, element: dict[str, Any], get_data=False) -> str:
         # the replace() is present for WELL_PLATE -> well-plate
-        url = f"https://{self.server}/api/v2/elements/{element['type'].lower().replace('_', '-')}/{element['id']}"
+        url = f"{self.base_url}/api/v2/elements/{element['type'].lower().replace('_', '-')}/{element['id']}"
         # for images we want to download the image
         if element['type'] == 'IMAGE' and get_data:
             url += '/original-data'
         if element['type'] == 'FILE' and get_data:
             url += '/download'
+        return url
+
+    def __get_element(self, element: dict[str, Any], get_data=False) -> requests.Response | CachedResponse | None:
+        url = self.__get_element_url(element, get_data)
         debug(f'GET {url}')
         debug(f'curl -v -H "Authorization: Bearer $LABFOLDER_TOKEN" {url}')
         debug('')
-        headers = {'Authorization': f'Bearer {self.token}'}
+        cache_key = self.__get_element_key(element) + ('-data' if get_data else '')
+        cached = self.cache.get(cache_key) if self.cache is not None else None
+        if cached is not None and self.cache is not None and self.cache.offline:
+            self.metrics.count('cache.hits')
+            return cached
+        # latencies are recorded per element type, with the endpoint of the payload
+        metric = element['type'] + url[url.rfind('/') :] if get_data else element['type']
         try:
-            response = requests.get(url, headers=headers)
+            # if we have a copy, only get the response again if it changed
+            headers = cached.get_validators() if cached is not None else {}
+            # payloads are streamed so they never need to fit in memory
+            response = self.__api_get(url, headers=headers, stream=get_data, metric=metric)
+            if response.status_code == 304 and cached is not None:
+                self.metrics.count('cache.not_modified')
+                response.close()
+                return cached
+            if not response.ok:
+                # a streamed response holds a slot of the scheduler until it is closed
+                response.close()
             response.raise_for_status()
+            if not get_data:
+                self.metrics.count('bytes.metadata', int(response.headers.get('Content-Length', 0)))
         except requests.exceptions.RequestException as e:
             print(f'Error getting element: {e}')
             debug('Skipping element that was not found:')
             debug(json.dumps(element, indent=2))
+            if cached is not None:
+                cached.close()
             return None
+        if self.cache is not None:
+            if cached is not None:
+                cached.close()
+            # a payload can break while it is stored, this is left to the caller so it can start over
+            return self.cache.put(cache_key, response)
         return response
-
-    def __get_csvs_from_json(self, json_metadata: dict[str, Any]) -> list[tuple[str, str]]:
-        """Transform a table from json to DataFrame"""
-        csvs: list[tuple[str, str]] = []
-        # for some reason sometimes Sheets are not present
-        sheets = json_metadata['content'].get('sheets', None)
-        if sheets is None:
-            debug('Skipping csv that has no sheets in content:')
-            debug(json.dumps(json_metadata, indent=2))
-            return csvs
-        # we process all the sheets, it will result in a different csv each
-        for sheet_name, sheet_val in sheets.items():
-            table_data = sheet_val['data'].get('dataTable', None)
-            if table_data is None:
-                debug('Skipping csv that has no dataTable in data:')
-                debug(json.dumps(json_metadata, indent=2))
-                continue
-            # column_names = [str(table_data['0'][str(i)].get('value', '')) for i in range(len(table_data['0']))]
-            rows = []
-            for key, values in table_data.items():
-                row = {}
-                for col_key, col_data in values.items():
-                    row[col_key] = col_data.get('value', 'N/A')
-                rows.append(row)
-
-            # Create DataFrame from the list of dictionaries
-            df = pd.DataFrame(rows)
-            # drop first row
-            # df = df.drop(0)
-            # None as first arg will return the csv as string instead of writing a file
-            csvs.append((sheet_name + '.csv', df.to_csv(None, index=False)))
-        return csvs
@@ -0,0 +1,93 @@
+# TheELNConsortium/any2eln
+# © 2024 Nicolas CARPi @ Deltablot
+# License MIT
+
+# merge the exports of several shards in a single export directory
+
+import json
+import re
+import shutil
+import sys
+from datetime import datetime
+from pathlib import Path
+from typing import Any
+
+from any2eln.labfolder.scripts import write_import_scripts
+from any2eln.utils.utils import read_jsonl
+
+
+def check_shards(shard_dirs: list[Path]) -> None:
+    """Make sure the directories are the complete exports of all the shards of a same set, before touching anything"""
+    if len(set(shard_dirs)) != len(shard_dirs):
+        print('Error: the same shard is given several times')
+        sys.exit(1)
+    indexes: dict[int, Path] = {}
+    counts = set()
+    eln_names: dict[str, Path] = {}
+    for shard_dir in shard_dirs:
+        if not shard_dir.joinpath('categories.json').exists():
+            print(f'Error: {shard_dir} is not a complete export')
+            sys.exit(1)
+        match = re.search(r'-shard-(\d+)-of-(\d+)$', shard_dir.name)
+        if match is None:
+            print(f'Error: {shard_dir} is not the export of a shard')
+            sys.exit(1)
+        index, count = int(match.group(1)), int(match.group(2))
+        if index in indexes:
+            print(f'Error: {shard_dir} and {indexes[index]} are both the export of shard {index}')
+            sys.exit(1)
+        indexes[index] = shard_dir
+        counts.add(count)
+        for eln in shard_dir.glob('*.eln'):
+            if eln.name in eln_names:
+                print(f'Error: {eln.name} is present in {eln_names[eln.name]} and {shard_dir}')
+                sys.exit(1)
+            eln_names[eln.name] = shard_dir
+    if len(counts) > 1:
+        splits = ', '.join(f'of-{count}' for count in sorted(counts))
+        print(f'Error: the shards are not from the same split, found {splits}')
+        sys.exit(1)
+    missing = sorted(set(range(1, counts.pop() + 1)) - set(indexes))
+    if missing:
+        print(f"Error: missing the export of shard {', '.join(str(index) for index in missing)}")
+        sys.exit(1)
+
+
+def merge(shard_dirs: list[Path], out_dir: Path) -> Path:
+    """Move the .eln of all the shards in a new export directory, and combine their summaries, manifests and scripts"""
+    shard_dirs = [shard_dir.resolve() for shard_dir in shard_dirs]
+    check_shards(shard_dirs)
+    now = datetime.now().strftime('%Y-%m-%d-%H-%M-%S')
+    main_dir = out_dir.joinpath(f'export-{now}-merged').resolve()
+    main_dir.mkdir()
+
+    summary_lines: dict[str, None] = {}
+    categories: dict[str, None] = {}
+    # records are keyed by entry id, so an entry is only listed once
+    manifest: dict[str, dict[str, Any]] = {}
+    deleted: dict[str, dict[str, Any]] = {}
+    for shard_dir in shard_dirs:
+        for eln in sorted(shard_dir.glob('*.eln')):
+            shutil.move(eln, main_dir.joinpath(eln.name))
+        # an author can show up in several shards if they were split by entries
+        summary_lines.update(dict.fromkeys(shard_dir.joinpath('summary.txt').read_text().splitlines()))
+        with shard_dir.joinpath('categories.json').open() as file:
+            categories.update(dict.fromkeys(json.load(file)))
+        manifest.update((record['id'], record) for record in read_jsonl(shard_dir.joinpath('manifest.jsonl')))
+        if shard_dir.joinpath('deleted-entries.json').exists():
+            with shard_dir.joinpath('deleted-entries.json').open() as file:
+                deleted.update((record['id'], record) for record in json.load(file))
+        print(f'Merged {shard_dir}')
+
+    with main_dir.joinpath('manifest.jsonl').open('w') as file:
+        file.writelines(json.dumps(record) + '\n' for record in manifest.values())
+    with main_dir.joinpath('summary.txt').open('w') as file:
+        file.write(''.join(f'\n{line}' for line in summary_lines if line))
+    with main_dir.joinpath('categories.json').open('w') as file:
+        json.dump(list(categories), file, indent=2)
+    if deleted:
+        with main_dir.joinpath('deleted-entries.json').open('w') as file:
+            json.dump(list(deleted.values()), file, indent=2)
+    write_import_scripts(main_dir, categories)
+    print(f'Merged export is in {main_dir}')
+    return main_dir
@@ -0,0 +1,101 @@
+# TheELNConsortium/any2eln
+# © 2024 Nicolas CARPi @ Deltablot
+# License MIT
+
+# scripts to run on the eLabFTW side after the import, to recreate the Labfolder projects
+
+from itertools import batched
+from pathlib import Path
+from typing import Collection
+
+# number of rows per INSERT in the sql script
+SQL_BATCH_SIZE = 1000
+# characters to escape in a mysql string, with the default sql_mode
+SQL_ESCAPES = {'\\': '\\\\', "'": "''", '\0': '\\0', '\n': '\\n', '\r': '\\r', '\x1a': '\\Z'}
+
+
+def write_import_scripts(main_dir: Path, categories: Collection[str]) -> None:
+    # create a script so we can create the Projects and then link experiments with same tag to them
+    with main_dir.joinpath('create-projects.py').open('w') as file:
+        file.write(get_project_script(categories))
+    # create a sql script to make links from experiments to projects
+    with main_dir.joinpath('create-links.sql').open('w') as file:
+        file.write(get_links_script(categories))
+
+
+def get_links_script(categories: Collection[str]) -> str:
+    """A sql script to link the experiments to the Project items with the same title as their tags.
+    The titles go in a staging table, so all the links are made by one statement whatever the number of projects."""
+    lines = [
+        '-- same column type and collation as the tags, so they can be compared',
+        'CREATE TEMPORARY TABLE labfolder_projects SELECT tag AS title FROM tags LIMIT 0;',
+    ]
+    # several rows per INSERT, but not so many that it goes over max_allowed_packet
+    for batch in batched(categories, SQL_BATCH_SIZE):
+        values = ',\n'.join(f'({sql_quote(category)})' for category in batch)
+        lines.append(f'INSERT INTO labfolder_projects (title) VALUES\n{values};')
+    lines.append("""-- ignore the links that already exist, so the script can be run again
+INSERT IGNORE INTO experiments_links (item_id, link_id)
+SELECT tags2entity.item_id, MIN(items.id)
+FROM labfolder_projects
+JOIN items ON items.title = labfolder_projects.title
+JOIN tags ON tags.tag = labfolder_projects.title
+JOIN tags2entity ON tags2entity.tag_id = tags.id AND tags2entity.item_type = 'experiments'
+GROUP BY tags2entity.item_id, labfolder_projects.title;
+DROP TEMPORARY TABLE labfolder_projects;""")
+    return '\n'.join(lines) + '\n'
+
+
+def sql_quote(value: str) -> str:
+    """Quote a string for mysql, so a project title cannot break out of it"""
+    for char, escaped in SQL_ESCAPES.items():
+        value = value.replace(char, escaped)
+    return f"'{value}'"
+
+
+def get_project_script(categories: Collection[str]) -> str:
+    """A python script creating a Project item for each category with the eLabFTW api, several at a time"""
+    projects = ''.join(f'    {category!r},\n' for category in categories)
+    return f"""#!/usr/bin/env python
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import elabapi_python
+API_HOST_URL = 'https://elab.local:3148/api/v2'
+API_KEY = 'apiKey4Test'
+# number of requests sent at the same time
+WORKERS = 8
+PROJECTS = [
+{projects}]
+configuration = elabapi_python.Configuration()
+configuration.api_key['api_key'] = API_KEY
+configuration.api_key_prefix['api_key'] = 'Authorization'
+configuration.host = API_HOST_URL
+configuration.debug = False
+configuration.verify_ssl = False
+configuration.connection_pool_maxsize = WORKERS
+api_client = elabapi_python.ApiClient(configuration)
+api_client.set_default_header(header_name='Authorization', header_value=API_KEY)
+itemsTypesApi = elabapi_python.ItemsTypesApi(api_client)
+response = itemsTypesApi.post_items_types_with_http_info(body={{'title': 'Projects'}})
+locationHeaderInResponse = response[2].get('Location')
+projects_cat_id = int(locationHeaderInResponse.split('=').pop())
+itemsApi = elabapi_python.ItemsApi(api_client)
+
+
+def create_project(title):
+    response = itemsApi.post_item_with_http_info(body={{'category_id': projects_cat_id}})
+    locationHeaderInResponse = response[2].get('Location')
+    itemId = int(locationHeaderInResponse.split('/').pop())
+    itemsApi.patch_item(itemId, body={{'title': title}})
+
+
+failed = []
+with ThreadPoolExecutor(max_workers=WORKERS) as executor:
+    futures = {{executor.submit(create_project, title): title for title in PROJECTS}}
+    for future in as_completed(futures):
+        try:
+            future.result()
+        except Exception as e:
+            print(f'Error creating project {{futures[future]!r}}: {{e}}')
+            failed.append(futures[future])
+print(f'Created {{len(PROJECTS) - len(failed)}} projects out of {{len(PROJECTS)}}')
+"""
@@ -0,0 +1,45 @@
+# TheELNConsortium/any2eln
+# © 2024 Nicolas CARPi @ Deltablot
+# License MIT
+
+import hashlib
+from typing import Any, Iterable, Protocol
+
+# size of the chunks read from the network
+CHUNK_SIZE = 1024 * 1024
+
+
+class Writable(Protocol):
+    """A binary file, or anything that can be written to like one"""
+
+    def write(self, data: bytes, /) -> int: ...
+
+
+class HashingWriter:
+    """Wrap a binary file and compute the sha256 and size of everything written to it"""
+
+    def __init__(self, file: Writable):
+        self.file = file
+        self.sha256 = hashlib.sha256()
+        self.size = 0
+
+    def write(self, data: bytes) -> int:
+        self.sha256.update(data)
+        self.size += len(data)
+        return self.file.write(data)
+
+    def get_node_fields(self) -> dict[str, Any]:
+        """The fields to add to the File node of what was written"""
+        fields: dict[str, Any] = {}
+        if self.size > 0:
+            fields['contentSize'] = self.size
+        fields['sha256'] = self.sha256.hexdigest()
+        return fields
+
+
+def write_chunks(file: Writable, chunks: Iterable[bytes]) -> dict[str, Any]:
+    """Write chunks to a file, hashing and counting them in the same pass. Returns the node fields."""
+    writer = HashingWriter(file)
+    for chunk in chunks:
+        writer.write(chunk)
+    return writer.get_node_fields()
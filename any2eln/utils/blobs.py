@@ -0,0 +1,104 @@
+# TheELNConsortium/any2eln
+# © 2024 Nicolas CARPi @ Deltablot
+# License MIT
+
+import json
+import os
+import tempfile
+import threading
+from pathlib import Path
+from typing import Any, Iterable
+
+from any2eln.utils.artifacts import HashingWriter
+
+
+class BlobStore:
+    """Content-addressed store of the downloaded payloads, so the same content is downloaded and stored only once.
+    Payloads are stored by sha256, and an index maps the identity of an element to the sha256 of its payload."""
+
+    def __init__(self, root: Path):
+        self.root = root
+        self.objects = root.joinpath('objects')
+        self.objects.mkdir(parents=True, exist_ok=True)
+        self.tmp = root.joinpath('tmp')
+        self.tmp.mkdir(exist_ok=True)
+        self.index_path = root.joinpath('index.jsonl')
+        # element key => sha256
+        self.index: dict[str, str] = {}
+        if self.index_path.exists():
+            with self.index_path.open() as file:
+                for line in file:
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue
+                    self.index[record['key']] = record['sha256']
+        self.index_file = self.index_path.open('a')
+        self.lock = threading.Lock()
+        # payloads we didn't have to download
+        self.reused_count = 0
+        self.reused_bytes = 0
+        # payloads downloaded but already stored under another element
+        self.duplicate_count = 0
+        self.duplicate_bytes = 0
+
+    def get_path(self, sha256: str) -> Path:
+        return self.objects.joinpath(sha256[:2], sha256)
+
+    def __get_fields(self, path: Path, sha256: str) -> dict[str, Any]:
+        fields: dict[str, Any] = {}
+        size = path.stat().st_size
+        if size > 0:
+            fields['contentSize'] = size
+        fields['sha256'] = sha256
+        return fields
+
+    def get(self, key: str) -> tuple[Path, dict[str, Any]] | None:
+        """Get the stored payload of an element, if we know it already"""
+        sha256 = self.index.get(key)
+        if sha256 is None:
+            return None
+        path = self.get_path(sha256)
+        if not path.exists():
+            return None
+        fields = self.__get_fields(path, sha256)
+        with self.lock:
+            self.reused_count += 1
+            self.reused_bytes += fields.get('contentSize', 0)
+        return path, fields
+
+    def add(self, key: str, chunks: Iterable[bytes]) -> tuple[Path, dict[str, Any]]:
+        """Store a payload, returns its path in the store and the node fields"""
+        with tempfile.NamedTemporaryFile(dir=self.tmp, delete=False) as file:
+            writer = HashingWriter(file)
+            try:
+                for chunk in chunks:
+                    writer.write(chunk)
+            except BaseException:
+                # the download broke, don't leave the partial payload behind
+                os.unlink(file.name)
+                raise
+        fields = writer.get_node_fields()
+        path = self.get_path(fields['sha256'])
+        with self.lock:
+            if path.exists():
+                os.unlink(file.name)
+                self.duplicate_count += 1
+                self.duplicate_bytes += writer.size
+            else:
+                path.parent.mkdir(exist_ok=True)
+                os.replace(file.name, path)
+            self.index[key] = fields['sha256']
+            self.index_file.write(json.dumps({'key': key, 'sha256': fields['sha256']}) + '\n')
+            self.index_file.flush()
+        return path, fields
+
+    def get_report(self) -> str:
+        mb = 1024 * 1024
+        return (
+            f'Deduplication: {self.reused_count} payloads ({self.reused_bytes / mb:.1f} MB) reused without download, '
+            f'{self.duplicate_count} duplicate payloads ({self.duplicate_bytes / mb:.1f} MB) stored only once'
+        )
+
+    def close(self) -> None:
+        self.index_file.close()
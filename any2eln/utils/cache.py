@@ -0,0 +1,128 @@
+# TheELNConsortium/any2eln
+# © 2024 Nicolas CARPi @ Deltablot
+# License MIT
+
+import json
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, BinaryIO, Iterator
+
+import requests
+
+from any2eln.utils.artifacts import CHUNK_SIZE
+
+
+class CachedResponse:
+    """A response read from the cache, with the same methods as the requests.Response we use"""
+
+    status_code = 200
+
+    def __init__(self, file: BinaryIO, meta: dict[str, Any]):
+        # the file is opened right away so it can still be read if it gets evicted in the meantime
+        self.file = file
+        self.headers = meta.get('headers', {})
+
+    def json(self) -> Any:
+        with self.file:
+            return json.load(self.file)
+
+    def iter_content(self, chunk_size=CHUNK_SIZE) -> Iterator[bytes]:
+        with self.file:
+            while chunk := self.file.read(chunk_size):
+                yield chunk
+
+    def get_validators(self) -> dict[str, str]:
+        """Headers to ask the server if our copy is still good"""
+        headers = {}
+        if 'ETag' in self.headers:
+            headers['If-None-Match'] = self.headers['ETag']
+        if 'Last-Modified' in self.headers:
+            headers['If-Modified-Since'] = self.headers['Last-Modified']
+        return headers
+
+    def close(self) -> None:
+        self.file.close()
+
+    def __enter__(self) -> 'CachedResponse':
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+
+class ResponseCache:
+    """On-disk cache of responses, bounded in size by evicting the least recently used ones"""
+
+    # only these headers are kept with the body
+    KEPT_HEADERS = ('Content-Type', 'ETag', 'Last-Modified')
+
+    def __init__(self, root: Path, max_size: int, offline=False):
+        self.root = root
+        self.root.mkdir(parents=True, exist_ok=True)
+        # max total size of the bodies, in bytes
+        self.max_size = max_size
+        # serve what we have without asking the server if it changed
+        self.offline = offline
+        self.lock = threading.Lock()
+        # key => size, the least recently used first
+        self.entries: OrderedDict[str, int] = OrderedDict()
+        self.size = 0
+        bodies = sorted(self.root.glob('*.body'), key=lambda path: path.stat().st_mtime)
+        for body in bodies:
+            if body.with_suffix('.json').exists():
+                self.entries[body.stem] = body.stat().st_size
+                self.size += body.stat().st_size
+
+    def get(self, key: str) -> CachedResponse | None:
+        body = self.root.joinpath(f'{key}.body')
+        with self.lock:
+            if key not in self.entries:
+                return None
+            self.entries.move_to_end(key)
+        try:
+            with body.with_suffix('.json').open() as file:
+                meta = json.load(file)
+            # the modification time keeps the lru order between runs
+            os.utime(body)
+            return CachedResponse(body.open('rb'), meta)
+        except (OSError, json.JSONDecodeError):
+            return None
+
+    def put(self, key: str, response: requests.Response) -> CachedResponse | requests.Response:
+        """Store a response and return it from the cache. Responses too big for the cache are returned untouched."""
+        if int(response.headers.get('Content-Length', 0)) > self.max_size:
+            return response
+        body = self.root.joinpath(f'{key}.body')
+        with response, tempfile.NamedTemporaryFile(dir=self.root, suffix='.tmp', delete=False) as file:
+            try:
+                for chunk in response.iter_content(CHUNK_SIZE):
+                    file.write(chunk)
+            except BaseException:
+                os.unlink(file.name)
+                raise
+        meta = {'headers': {name: response.headers[name] for name in self.KEPT_HEADERS if name in response.headers}}
+        size = os.path.getsize(file.name)
+        with self.lock:
+            os.replace(file.name, body)
+            with body.with_suffix('.json').open('w') as meta_file:
+                json.dump(meta, meta_file)
+            self.size += size - self.entries.pop(key, 0)
+            self.entries[key] = size
+            cached = CachedResponse(body.open('rb'), meta)
+            self.__evict()
+        return cached
+
+    def __evict(self) -> None:
+        # keep the last one, it is about to be used
+        while self.size > self.max_size and len(self.entries) > 1:
+            key, size = self.entries.popitem(last=False)
+            self.size -= size
+            for suffix in ('body', 'json'):
+                try:
+                    self.root.joinpath(f'{key}.{suffix}').unlink(missing_ok=True)
+                except OSError:
+                    # it is still open somewhere, it will be overwritten or evicted on a later run
+                    pass
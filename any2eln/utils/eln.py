@@ -0,0 +1,187 @@
+# TheELNConsortium/any2eln
+# © 2024 Nicolas CARPi @ Deltablot
+# License MIT
+
+# writers for the content of a .eln archive
+# DirectoryWriter stages everything on disk and zips it at the end
+# ZipWriter writes the files straight into the archive
+
+import os
+import shutil
+import tempfile
+import threading
+import time
+import zipfile
+from contextlib import contextmanager
+from pathlib import Path
+from io import BytesIO
+from typing import IO, BinaryIO, Iterator
+
+# files smaller than this are buffered in memory before being added to the zip, bigger ones in a temporary file
+SPOOL_SIZE = 16 * 1024 * 1024
+
+# these formats are already compressed, deflating them again is only a waste of cpu
+COMPRESSED_TYPES = {
+    'application/gzip',
+    'application/vnd.rar',
+    'application/x-7z-compressed',
+    'application/x-bzip2',
+    'application/x-gzip',
+    'application/x-rar-compressed',
+    'application/x-xz',
+    'application/zip',
+    'image/avif',
+    'image/gif',
+    'image/heic',
+    'image/jpeg',
+    'image/png',
+    'image/webp',
+}
+
+
+def is_compressed(content_type: str | None) -> bool:
+    """Check if a content type is already compressed"""
+    if content_type is None:
+        return False
+    content_type = content_type.split(';')[0].strip().lower()
+    return content_type in COMPRESSED_TYPES or content_type.startswith(('audio/', 'video/'))
+
+
+def pack_eln(root: Path, eln_path: Path) -> Path:
+    """Zip a staging directory into a .eln. This is a plain function so it can run in another process."""
+    # create a container directory because shutil will gobble up the folder
+    container = root.with_name(f'{root.name}-container')
+    container.mkdir()
+    root.rename(container.joinpath(root.name))
+    eln_zip = shutil.make_archive(str(eln_path), 'zip', container)
+    # shutil will add a .zip extension but we want a .eln
+    Path(eln_zip).rename(eln_path)
+    return eln_path
+
+
+class DirectoryWriter:
+    """Write the files in a staging directory, then zip it when closing"""
+
+    def __init__(self, eln_path: Path):
+        self.eln_path = eln_path
+        # the folder has the same name as the archive, and is the root folder inside the archive
+        self.root = eln_path.with_suffix('')
+        # when resuming, the folder might have been moved already in its container before the zip was done
+        container = self.root.with_name(f'{self.root.name}-container')
+        if container.joinpath(self.root.name).exists():
+            container.joinpath(self.root.name).rename(self.root)
+            shutil.rmtree(container)
+        self.root.mkdir(exist_ok=True)
+
+    def mkdir(self, name: str) -> None:
+        self.root.joinpath(name).mkdir(parents=True, exist_ok=True)
+
+    @contextmanager
+    def open(self, name: str, compress=True) -> Iterator[BinaryIO]:
+        path = self.root.joinpath(name)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with path.open('wb') as file:
+            yield file
+
+    def add_file(self, name: str, source: Path, compress=True) -> None:
+        """Add an existing file, hardlinked when possible so it doesn't take more space"""
+        path = self.root.joinpath(name)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.unlink(missing_ok=True)
+        try:
+            os.link(source, path)
+        except OSError:
+            # not on the same filesystem
+            shutil.copyfile(source, path)
+
+    def close(self) -> Path:
+        return pack_eln(self.root, self.eln_path)
+
+
+class ZipMember:
+    """A file being written in a ZipWriter. It is buffered in memory, or in a temporary file once it outgrows
+    the buffer, and only added to the zip when it is closed, so the lock is never held while a download runs."""
+
+    def __init__(self, writer: 'ZipWriter', info: zipfile.ZipInfo):
+        self.writer = writer
+        self.info = info
+        self.file: IO[bytes] = BytesIO()
+
+    def write(self, data: bytes) -> int:
+        if isinstance(self.file, BytesIO) and self.file.tell() + len(data) > SPOOL_SIZE:
+            spill = tempfile.TemporaryFile(dir=self.writer.part_path.parent)
+            spill.write(self.file.getbuffer())
+            self.file = spill
+        return self.file.write(data)
+
+    def close(self) -> None:
+        try:
+            with self.writer.lock:
+                member = self.writer.zip.open(self.info, 'w', force_zip64=True)
+                try:
+                    if isinstance(self.file, BytesIO):
+                        member.write(self.file.getbuffer())
+                    else:
+                        self.file.seek(0)
+                        shutil.copyfileobj(self.file, member)
+                except BaseException:
+                    self.__forget(member)
+                    raise
+                member.close()
+        finally:
+            self.file.close()
+
+    def abort(self) -> None:
+        """Forget a file that could not be written completely"""
+        self.file.close()
+
+    def __forget(self, member: IO[bytes]) -> None:
+        """Close a member that failed, a zip cannot shrink but without its central directory record
+        the partial file is not part of it"""
+        try:
+            member.close()
+        finally:
+            if self.info in self.writer.zip.filelist:
+                self.writer.zip.filelist.remove(self.info)
+                self.writer.zip.NameToInfo.pop(self.info.filename, None)
+
+
+class ZipWriter:
+    """Write the files directly in the .eln archive, without a staging directory"""
+
+    def __init__(self, eln_path: Path):
+        self.eln_path = eln_path
+        self.root = eln_path.stem
+        # write to a temporary name so an unfinished archive is never mistaken for a complete one
+        self.part_path = eln_path.with_name(f'{eln_path.name}.part')
+        self.zip = zipfile.ZipFile(self.part_path, 'w', compression=zipfile.ZIP_DEFLATED)
+        # only one member can be written at a time in a zip
+        self.lock = threading.Lock()
+
+    def mkdir(self, name: str) -> None:
+        with self.lock:
+            self.zip.mkdir(f'{self.root}/{name}')
+
+    @contextmanager
+    def open(self, name: str, compress=True) -> Iterator[ZipMember]:
+        info = zipfile.ZipInfo(f'{self.root}/{name}', date_time=time.localtime()[:6])
+        info.external_attr = 0o644 << 16
+        info.compress_type = zipfile.ZIP_DEFLATED if compress else zipfile.ZIP_STORED
+        member = ZipMember(self, info)
+        try:
+            yield member
+        except BaseException:
+            member.abort()
+            raise
+        member.close()
+
+    def add_file(self, name: str, source: Path, compress=True) -> None:
+        """Add an existing file"""
+        compress_type = zipfile.ZIP_DEFLATED if compress else zipfile.ZIP_STORED
+        with self.lock:
+            self.zip.write(source, f'{self.root}/{name}', compress_type=compress_type)
+
+    def close(self) -> Path:
+        self.zip.close()
+        self.part_path.rename(self.eln_path)
+        return self.eln_path
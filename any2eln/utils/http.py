@@ -0,0 +1,175 @@
+# TheELNConsortium/any2eln
+# © 2024 Nicolas CARPi @ Deltablot
+# License MIT
+
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from any2eln.utils.metrics import Metrics
+from any2eln.utils.utils import debug
+
+# the server is overloaded or having a hiccup, these are worth trying again
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+# the server explicitly tells us to slow down with these
+PUSHBACK_STATUSES = {429, 503}
+
+
+def get_session(pool_size: int) -> requests.Session:
+    """Create a Session with a keep-alive connection pool big enough for all the workers"""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+def get_retry_after(response: requests.Response) -> float | None:
+    """Read the Retry-After header, that can be a number of seconds or a date"""
+    value = response.headers.get('Retry-After')
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class RequestScheduler:
+    """Send all the requests with a timeout and retries, and adapt the concurrency to what the server can take.
+    The number of requests in flight grows by one per window of successful requests,
+    and is halved when the server pushes back.
+    """
+
+    def __init__(
+        self,
+        session: requests.Session,
+        max_concurrency: int,
+        timeout=(10, 120),
+        retries=5,
+        backoff=1.0,
+        metrics: Metrics | None = None,
+        initial_concurrency: int | None = None,
+    ):
+        self.session = session
+        self.max_concurrency = max_concurrency
+        # (connect, read) timeouts in seconds
+        self.timeout = timeout
+        self.retries = retries
+        # base delay in seconds for the exponential backoff
+        self.backoff = backoff
+        self.max_backoff = 60.0
+        # how many requests are allowed in flight right now, it starts at the expected load and can grow up to the max
+        self.limit = float(min(initial_concurrency or max_concurrency, max_concurrency))
+        self.active = 0
+        self.last_decrease = 0.0
+        self.condition = threading.Condition()
+        # latencies are recorded under the metric name given to request(), retries and errors are counted
+        self.metrics = metrics
+
+    def __acquire(self) -> None:
+        with self.condition:
+            while self.active >= int(self.limit):
+                self.condition.wait()
+            self.active += 1
+
+    def __release(self) -> None:
+        with self.condition:
+            self.active -= 1
+            self.condition.notify_all()
+
+    def __on_success(self) -> None:
+        with self.condition:
+            if self.limit < self.max_concurrency:
+                self.limit = min(self.max_concurrency, self.limit + 1 / self.limit)
+                self.condition.notify_all()
+
+    def __on_pushback(self) -> None:
+        with self.condition:
+            # only decrease once per second, requests already in flight will likely fail too
+            now = time.monotonic()
+            if now - self.last_decrease > 1:
+                # halve what is really in flight, with the request that was pushed back, a limit above it changes nothing
+                self.limit = max(1.0, min(self.limit, self.active + 1) / 2)
+                self.last_decrease = now
+                debug(f'Server pushed back, concurrency is now {int(self.limit)}')
+
+    def wait(self, attempt: int, retry_after: float | None = None) -> None:
+        """Sleep before the next attempt: what the server asked for, or an exponential backoff with full jitter"""
+        if retry_after is None:
+            retry_after = random.uniform(0, min(self.max_backoff, self.backoff * 2**attempt))
+        time.sleep(retry_after)
+
+    def __release_on_close(self, response: requests.Response) -> None:
+        """Keep the slot of a streamed response until its body is closed, so the limit applies to the transfers"""
+        close = response.close
+        released = False
+
+        def release_and_close() -> None:
+            nonlocal released
+            try:
+                close()
+            finally:
+                if not released:
+                    released = True
+                    self.__release()
+
+        response.close = release_and_close  # type: ignore[method-assign]
+
+    def __count(self, name: str) -> None:
+        if self.metrics is not None:
+            self.metrics.count(name)
+
+    def request(self, method: str, url: str, metric: str | None = None, **kwargs) -> requests.Response:
+        """Send a request, retrying on network errors and transient errors.
+        The last response is returned if all attempts failed with an http error, so the caller can decide what to do.
+        The latency of each attempt is recorded under the metric name, if any.
+        A streamed response counts against the concurrency limit until it is closed, so it must always be closed."""
+        kwargs.setdefault('timeout', self.timeout)
+        for attempt in range(self.retries + 1):
+            if attempt > 0:
+                self.__count('requests.retries')
+            self.__acquire()
+            start = time.monotonic()
+            try:
+                self.__count('requests.sent')
+                response = self.session.request(method, url, **kwargs)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                self.__release()
+                self.__count('requests.network_errors')
+                self.__on_pushback()
+                if attempt == self.retries:
+                    raise
+                debug(f'Retrying {url} after error: {e}')
+                self.wait(attempt)
+                continue
+            except BaseException:
+                self.__release()
+                raise
+            if kwargs.get('stream'):
+                self.__release_on_close(response)
+            else:
+                self.__release()
+            if self.metrics is not None and metric is not None:
+                self.metrics.observe(metric, time.monotonic() - start)
+            if response.status_code >= 400:
+                self.__count(f'requests.status.{response.status_code}')
+            if response.status_code not in RETRY_STATUSES:
+                self.__on_success()
+                return response
+            if response.status_code in PUSHBACK_STATUSES:
+                self.__on_pushback()
+            if attempt == self.retries:
+                break
+            debug(f'Retrying {url} after status {response.status_code}')
+            response.close()
+            self.wait(attempt, get_retry_after(response))
+        return response
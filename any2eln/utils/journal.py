@@ -0,0 +1,73 @@
+# TheELNConsortium/any2eln
+# © 2024 Nicolas CARPi @ Deltablot
+# License MIT
+
+import json
+from pathlib import Path
+from typing import Any
+
+
+class Journal:
+    """Append-only log of the elements saved for an author, so an interrupted export can be resumed"""
+
+    def __init__(self, path: Path, load=True):
+        self.path = path
+        # element key => the nodes and text content it produced
+        self.elements: dict[str, dict[str, Any]] = {}
+        # keys of the elements that could not be saved, they are tried again on resume
+        self.failed: set[str] = set()
+        # set once the .eln for this author is complete
+        self.done = False
+        # there is no need to read it all if we only want to append to it
+        if load and path.exists():
+            self.__load()
+        self.file = path.open('a')
+
+    def __load(self) -> None:
+        with self.path.open() as file:
+            lines = file.readlines()
+        for line in lines:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # the last line can be truncated if the process was killed while writing it
+                continue
+            if record['type'] == 'element':
+                self.elements[record['key']] = record
+                self.failed.discard(record['key'])
+            elif record['type'] == 'failed':
+                self.failed.add(record['key'])
+            elif record['type'] == 'done':
+                self.done = True
+        # make sure new records don't end up on the same line as a truncated one
+        if lines and not lines[-1].endswith('\n'):
+            with self.path.open('a') as file:
+                file.write('\n')
+
+    def __append(self, record: dict[str, Any]) -> None:
+        self.file.write(json.dumps(record) + '\n')
+        self.file.flush()
+
+    def add_element(self, key: str, nodes: list[dict[str, Any]], text: str | None) -> None:
+        record = {'type': 'element', 'key': key, 'nodes': nodes, 'text': text}
+        self.elements[key] = record
+        self.failed.discard(key)
+        self.__append(record)
+
+    def add_failed(self, key: str) -> None:
+        self.failed.add(key)
+        self.__append({'type': 'failed', 'key': key})
+
+    def mark_done(self) -> None:
+        self.done = True
+        self.__append({'type': 'done'})
+
+    def reset(self) -> None:
+        """Forget everything, used when the files recorded are lost"""
+        self.elements = {}
+        self.failed = set()
+        self.done = False
+        self.file.truncate(0)
+
+    def close(self) -> None:
+        self.file.close()
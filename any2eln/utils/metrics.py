@@ -0,0 +1,197 @@
+# TheELNConsortium/any2eln
+# © 2024 Nicolas CARPi @ Deltablot
+# License MIT
+
+import bisect
+import json
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Callable, Iterable, Iterator, TypeVar
+
+R = TypeVar('R')
+
+# upper bounds of the latency buckets, in seconds
+LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+class Histogram:
+    """Count observations in fixed buckets, so percentiles can be estimated without keeping every value"""
+
+    def __init__(self, bounds: tuple[float, ...] = LATENCY_BUCKETS):
+        self.bounds = bounds
+        # the last bucket is for everything above the last bound
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def get_percentile(self, percentile: float) -> float:
+        """Upper bound of the bucket holding the percentile, or the max if it is in the last bucket"""
+        rank = percentile / 100 * self.count
+        seen = 0
+        for bound, count in zip(self.bounds, self.counts):
+            seen += count
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+    def to_dict(self) -> dict[str, Any]:
+        return {
+            'count': self.count,
+            'sum': round(self.sum, 6),
+            'mean': round(self.sum / self.count, 6) if self.count else 0.0,
+            'max': round(self.max, 6),
+            'p50': round(self.get_percentile(50), 6),
+            'p90': round(self.get_percentile(90), 6),
+            'p99': round(self.get_percentile(99), 6),
+            'buckets': {str(bound): count for bound, count in zip(self.bounds + ('+Inf',), self.counts)},
+        }
+
+
+class Metrics:
+    """Collect what an export spent its time on, shared by all the threads.
+    Phases are sequential steps timed by the wall clock. Timers add up the time spent in an operation
+    by all the threads, so they can be larger than the wall time of the export."""
+
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.start = time.monotonic()
+        self.phases: dict[str, float] = {}
+        self.timers: dict[str, float] = {}
+        self.counters: dict[str, int] = {}
+        self.latencies: dict[str, Histogram] = {}
+        self.authors: dict[str, dict[str, float]] = {}
+        # for the progress line
+        self.entries_total = 0
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.add_phase(name, time.monotonic() - start)
+
+    def add_phase(self, name: str, seconds: float) -> None:
+        with self.lock:
+            self.phases[name] = self.phases.get(name, 0.0) + seconds
+
+    @contextmanager
+    def timer(self, name: str) -> Iterator[None]:
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.add_time(name, time.monotonic() - start)
+
+    def add_time(self, name: str, seconds: float) -> None:
+        with self.lock:
+            self.timers[name] = self.timers.get(name, 0.0) + seconds
+
+    def count(self, name: str, value: int = 1) -> None:
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def observe(self, name: str, seconds: float) -> None:
+        """Record the latency of a request"""
+        with self.lock:
+            self.latencies.setdefault(name, Histogram()).observe(seconds)
+
+    def add_author(self, author: Any, **totals: float) -> None:
+        with self.lock:
+            author_totals = self.authors.setdefault(str(author), {})
+            for name, value in totals.items():
+                author_totals[name] = author_totals.get(name, 0) + value
+
+    def measure(self, chunks: Iterable[bytes], name: str, consumer: str) -> Iterator[bytes]:
+        """Pass the chunks through, adding up their size, the time spent waiting for them under name
+        and the time spent processing them under consumer"""
+        iterator = iter(chunks)
+        while True:
+            start = time.monotonic()
+            try:
+                chunk = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                self.add_time(name, time.monotonic() - start)
+            self.count(f'bytes.{name}', len(chunk))
+            start = time.monotonic()
+            yield chunk
+            self.add_time(consumer, time.monotonic() - start)
+
+    def get_elapsed(self) -> float:
+        return time.monotonic() - self.start
+
+    def get_progress_line(self) -> str:
+        with self.lock:
+            counters = dict(self.counters)
+        elapsed = self.get_elapsed()
+        minutes, seconds = divmod(int(elapsed), 60)
+        entries = counters.get('entries.done', 0)
+        percent = f' ({100 * entries / self.entries_total:.1f}%)' if self.entries_total else ''
+        size = counters.get('bytes.download', 0) / 1e6
+        return (
+            f'[{minutes // 60:02d}:{minutes % 60:02d}:{seconds:02d}]'
+            f' entries {entries}/{self.entries_total}{percent}'
+            f" | elements {counters.get('elements.saved', 0)}"
+            f' | {size:.1f} MB ({size / elapsed if elapsed else 0:.2f} MB/s)'
+            f" | retries {counters.get('requests.retries', 0)}"
+            f" | skipped {counters.get('elements.skipped', 0)}"
+        )
+
+    def to_dict(self) -> dict[str, Any]:
+        with self.lock:
+            return {
+                'elapsed': round(self.get_elapsed(), 3),
+                'phases': {name: round(seconds, 3) for name, seconds in self.phases.items()},
+                'timers': {name: round(seconds, 3) for name, seconds in sorted(self.timers.items())},
+                'counters': dict(sorted(self.counters.items())),
+                'latencies': {name: histogram.to_dict() for name, histogram in sorted(self.latencies.items())},
+                'authors': {
+                    author: {name: round(value, 3) for name, value in totals.items()}
+                    for author, totals in self.authors.items()
+                },
+            }
+
+    def write(self, path: Path) -> None:
+        with path.open('w') as file:
+            json.dump(self.to_dict(), file, indent=2)
+
+
+class ProgressReporter:
+    """Print a progress line at a fixed interval, for logs where the progress bars are not readable"""
+
+    def __init__(self, metrics: Metrics, interval: float):
+        self.metrics = metrics
+        self.interval = interval
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.__run, daemon=True)
+
+    def __run(self) -> None:
+        while not self.stopped.wait(self.interval):
+            print(self.metrics.get_progress_line(), flush=True)
+
+    def __enter__(self) -> 'ProgressReporter':
+        self.thread.start()
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.stopped.set()
+        self.thread.join()
+        print(self.metrics.get_progress_line(), flush=True)
+
+
+def timed(fn: Callable[..., R], *args: Any) -> tuple[R, float]:
+    """Call a function and also return how long it took, this can run in another process"""
+    start = time.monotonic()
+    result = fn(*args)
+    return result, time.monotonic() - start
@@ -2,8 +2,10 @@
 # © 2024 Nicolas CARPi @ Deltablot
 # License MIT
 
+import json
+import textwrap
 from datetime import datetime
-from typing import Any
+from typing import IO, Any
 
 
 def get_crate_metadata() -> dict[str, Any]:
@@ -21,3 +23,37 @@ def get_crate_metadata() -> dict[str, Any]:
 
     crate_metadata['@graph'].append(crate_node)
     return crate_metadata
+
+
+class CrateBuilder:
+    """Build the ro-crate-metadata.json of an archive, writing the nodes of the @graph to a file as they are added.
+    Only the ids of the nodes are kept in memory, to make sure a node is added only once.
+    Without a file, the nodes are only indexed."""
+
+    def __init__(self, file: IO[bytes] | None = None):
+        self.file = file
+        self.ids: set[str] = set()
+        crate_metadata = get_crate_metadata()
+        if self.file is not None:
+            # same output as json.dump(crate_metadata, indent=2), one node at a time
+            self.file.write(f'{{\n  "@context": {json.dumps(crate_metadata["@context"])},\n  "@graph": ['.encode())
+        for node in crate_metadata['@graph']:
+            self.add(node)
+
+    def has(self, node_id: str) -> bool:
+        return node_id in self.ids
+
+    def add(self, node: dict[str, Any]) -> bool:
+        """Add a node to the graph, unless there is already one with the same @id. Returns True if it was added."""
+        if node['@id'] in self.ids:
+            return False
+        if self.file is not None:
+            separator = ',\n' if self.ids else '\n'
+            self.file.write((separator + textwrap.indent(json.dumps(node, indent=2), '    ')).encode())
+        self.ids.add(node['@id'])
+        return True
+
+    def close(self) -> None:
+        if self.file is not None:
+            self.file.write(b'\n  ]\n}')
+            self.file.close()
@@ -0,0 +1,56 @@
+# TheELNConsortium/any2eln
+# © 2024 Nicolas CARPi @ Deltablot
+# License MIT
+
+# convert the tables of spreadsheet-like elements to csv
+
+import csv
+import json
+from typing import Any, Iterator
+
+from any2eln.utils.artifacts import HashingWriter, Writable
+from any2eln.utils.utils import debug
+
+
+class TextEncoder:
+    """Let the csv module write text to a binary file"""
+
+    def __init__(self, file: HashingWriter):
+        self.file = file
+
+    def write(self, text: str) -> int:
+        return self.file.write(text.encode())
+
+
+def get_sheets(json_metadata: dict[str, Any]) -> Iterator[tuple[str, dict[str, dict[str, Any]]]]:
+    """Yield the name and the data table of each sheet of a TABLE or WELL_PLATE element"""
+    # for some reason sometimes Sheets are not present
+    sheets = json_metadata['content'].get('sheets', None)
+    if sheets is None:
+        debug('Skipping csv that has no sheets in content:')
+        debug(json.dumps(json_metadata, indent=2))
+        return
+    for sheet_name, sheet_val in sheets.items():
+        table_data = sheet_val['data'].get('dataTable', None)
+        if table_data is None:
+            debug('Skipping csv that has no dataTable in data:')
+            debug(json.dumps(json_metadata, indent=2))
+            continue
+        yield sheet_name, table_data
+
+
+def write_csv(file: Writable, table_data: dict[str, dict[str, Any]]) -> dict[str, Any]:
+    """Write a data table as csv, row by row. Returns the node fields.
+    The table is sparse: rows and columns are indexed by numbers as strings, and empty cells are missing."""
+    # all the rows don't have the same cells, so get the widest one, and fill the gaps with empty cells
+    columns = 1 + max((int(col_key) for values in table_data.values() for col_key in values), default=-1)
+    hashing = HashingWriter(file)
+    writer = csv.writer(TextEncoder(hashing), lineterminator='\n')
+    # the first line has the column numbers
+    writer.writerow(range(columns))
+    for row_key in sorted(table_data, key=int):
+        row = [''] * columns
+        for col_key, col_data in table_data[row_key].items():
+            row[int(col_key)] = col_data.get('value', 'N/A')
+        writer.writerow(row)
+    return hashing.get_node_fields()
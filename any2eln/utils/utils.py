@@ -1,7 +1,15 @@
 # TheELNConsortium/any2eln
 # © 2024 Nicolas CARPi @ Deltablot
 # License MIT
+import json
 import os
+from collections import deque
+from concurrent.futures import Executor, Future
+from pathlib import Path
+from typing import Any, Callable, Iterable, Iterator, TypeVar
+
+T = TypeVar('T')
+R = TypeVar('R')
 
 
 def env_or_ask(envname: str, prompt: str) -> str:
@@ -12,7 +20,25 @@ def env_or_ask(envname: str, prompt: str) -> str:
     return input(prompt)
 
 
+def read_jsonl(path: Path) -> Iterator[Any]:
+    """Read a file with one json document per line"""
+    with path.open() as file:
+        for line in file:
+            yield json.loads(line)
+
+
 def debug(line: str) -> None:
     """Only print something if DEV=1 in env"""
     if os.getenv('DEV') == '1':
         print(line)
+
+
+def ordered_map(executor: Executor, fn: Callable[[T], R], iterable: Iterable[T], window: int) -> Iterator[R]:
+    """Like executor.map() but only keep `window` tasks in flight. Results are yielded in input order."""
+    pending: deque[Future[R]] = deque()
+    for item in iterable:
+        pending.append(executor.submit(fn, item))
+        if len(pending) >= window:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
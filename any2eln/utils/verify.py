@@ -0,0 +1,147 @@
+# TheELNConsortium/any2eln
+# © 2024 Nicolas CARPi @ Deltablot
+# License MIT
+
+# check that .eln archives are complete and intact, without extracting them
+
+import hashlib
+import json
+import multiprocessing
+import sys
+import time
+import zipfile
+from concurrent.futures import Future, ProcessPoolExecutor
+from pathlib import Path
+from typing import Any
+
+from any2eln.utils.artifacts import CHUNK_SIZE
+
+# files of an archive are checked in batches of about this many bytes, so big archives are spread over the processes
+BATCH_SIZE = 256 * 1024 * 1024
+
+
+def get_archives(paths: list[Path]) -> list[Path]:
+    """The .eln files given, or found in the export directories given"""
+    archives = []
+    for path in paths:
+        archives.extend(sorted(path.glob('*.eln')) if path.is_dir() else [path])
+    return archives
+
+
+def get_root(archive: zipfile.ZipFile) -> str:
+    """The folder holding ro-crate-metadata.json, with a trailing slash"""
+    for name in archive.namelist():
+        parts = name.split('/')
+        if len(parts) == 2 and parts[1] == 'ro-crate-metadata.json':
+            return parts[0] + '/'
+    raise KeyError('no ro-crate-metadata.json found')
+
+
+def check_graph(eln_path: Path) -> tuple[list[dict[str, Any]], list[str]]:
+    """Read the graph of an archive and check the references of hasPart.
+    Returns the File nodes with the name of their member in the zip, and the errors found."""
+    files: list[dict[str, Any]] = []
+    errors: list[str] = []
+    try:
+        with zipfile.ZipFile(eln_path) as archive:
+            root = get_root(archive)
+            graph = json.loads(archive.read(root + 'ro-crate-metadata.json'))['@graph']
+            names = set(archive.namelist())
+            # a folder might not have its own entry, but then it has files in it
+            folders = {name[: name.rindex('/') + 1] for name in names}
+            sizes = {info.filename: info.file_size for info in archive.infolist()}
+    except (OSError, KeyError, ValueError, zipfile.BadZipFile) as e:
+        return [], [f'{eln_path}: cannot read the archive: {e}']
+
+    nodes = {node['@id']: node for node in graph}
+    for node in graph:
+        for part in node.get('hasPart', []):
+            if part.get('@id') not in nodes:
+                errors.append(f"{eln_path}: {node['@id']} has a part {part.get('@id')} that is not in the graph")
+        if node.get('@type') == 'Dataset' and node['@id'] != './':
+            if root + node['@id'].removeprefix('./') + '/' not in folders:
+                errors.append(f"{eln_path}: folder {node['@id']} is missing")
+        if node.get('@type') == 'File':
+            name = root + node['@id'].removeprefix('./')
+            if name not in names:
+                errors.append(f"{eln_path}: file {node['@id']} is missing")
+                continue
+            files.append({**node, 'member': name, 'size': sizes[name]})
+    return files, errors
+
+
+def check_files(eln_path: Path, files: list[dict[str, Any]]) -> tuple[int, list[str]]:
+    """Stream the files from the archive and compare them with their node. Returns the bytes read and the errors.
+    This is a plain function so it can run in another process."""
+    errors = []
+    size = 0
+    try:
+        with zipfile.ZipFile(eln_path) as archive:
+            for node in files:
+                sha256 = hashlib.sha256()
+                file_size = 0
+                try:
+                    # the crc of the member is also checked when it is read to the end
+                    with archive.open(node['member']) as file:
+                        while chunk := file.read(CHUNK_SIZE):
+                            sha256.update(chunk)
+                            file_size += len(chunk)
+                except (OSError, zipfile.BadZipFile) as e:
+                    errors.append(f"{eln_path}: file {node['@id']} cannot be read: {e}")
+                    continue
+                size += file_size
+                if 'contentSize' in node and int(node['contentSize']) != file_size:
+                    errors.append(
+                        f"{eln_path}: file {node['@id']} has {file_size} bytes instead of {node['contentSize']}"
+                    )
+                if 'sha256' in node and node['sha256'] != sha256.hexdigest():
+                    errors.append(f"{eln_path}: file {node['@id']} does not match its sha256")
+    except (OSError, zipfile.BadZipFile) as e:
+        errors.append(f'{eln_path}: cannot read the archive: {e}')
+    return size, errors
+
+
+def get_batches(files: list[dict[str, Any]]) -> list[list[dict[str, Any]]]:
+    """Group the files of an archive in batches of about BATCH_SIZE bytes"""
+    batches: list[list[dict[str, Any]]] = [[]]
+    batch_size = 0
+    for node in files:
+        if batch_size >= BATCH_SIZE:
+            batches.append([])
+            batch_size = 0
+        batches[-1].append(node)
+        batch_size += node['size']
+    return batches
+
+
+def verify(paths: list[Path], jobs: int | None = None) -> bool:
+    """Check the files of the archives against the sha256 and contentSize of their nodes. True if all is fine."""
+    archives = get_archives(paths)
+    if not archives:
+        print('Error: no .eln archive found')
+        sys.exit(1)
+    start = time.monotonic()
+    errors: list[str] = []
+    files_count = 0
+    size = 0
+    with ProcessPoolExecutor(max_workers=jobs, mp_context=multiprocessing.get_context('spawn')) as executor:
+        futures: list[Future[tuple[int, list[str]]]] = []
+        for eln_path in archives:
+            files, graph_errors = check_graph(eln_path)
+            errors.extend(graph_errors)
+            files_count += len(files)
+            futures.extend(executor.submit(check_files, eln_path, batch) for batch in get_batches(files) if batch)
+        for future in futures:
+            batch_size, batch_errors = future.result()
+            size += batch_size
+            errors.extend(batch_errors)
+    elapsed = time.monotonic() - start
+
+    for error in errors:
+        print(error)
+    print(
+        f'Checked {files_count} files ({size / 1e6:.1f} MB) in {len(archives)} archives'
+        f' in {elapsed:.1f} s ({size / 1e6 / elapsed if elapsed else 0:.1f} MB/s)'
+    )
+    print(f'Found {len(errors)} errors' if errors else 'All archives are complete')
+    return not errors
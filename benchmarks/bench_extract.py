@@ -0,0 +1,87 @@
+# TheELNConsortium/any2eln
+# © 2024 Nicolas CARPi @ Deltablot
+# License MIT
+
+# run Labfolder.extract against the mock server and report throughput
+# run it with: uv run -m benchmarks.bench_extract --help
+
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from any2eln.labfolder.labfolder import Labfolder
+from benchmarks.mock_labfolder import add_account_arguments, get_account
+
+
+def start_mock(args: argparse.Namespace) -> tuple[subprocess.Popen, str]:
+    """Serve the account from another process, so it does not compete with the extraction for the GIL"""
+    command = [sys.executable, '-m', 'benchmarks.mock_labfolder', '--port', '0']
+    for name in ('authors', 'entries', 'elements', 'payload_size', 'latency', 'error_rate', 'seed'):
+        command += [f"--{name.replace('_', '-')}", str(getattr(args, name))]
+    if args.no_range:
+        command.append('--no-range')
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, text=True)
+    assert process.stdout is not None
+    # first line is: Serving on http://127.0.0.1:port, ...
+    url = process.stdout.readline().split()[2].rstrip(',')
+    return process, url
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Benchmark the Labfolder extraction against a mock server')
+    add_account_arguments(parser)
+    parser.add_argument('--workers', type=int, default=4, help='number of elements downloaded concurrently')
+    parser.add_argument('--page-size', type=int, default=100, help='number of entries requested per page')
+    parser.add_argument('--stream-zip', action='store_true', help='write archives directly instead of staging')
+    parser.add_argument('--out_dir', help='keep the export in this directory instead of a temporary one')
+    args = parser.parse_args()
+
+    account = get_account(args)
+    process, url = start_mock(args)
+    try:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            out_dir = args.out_dir or tmp_dir
+            lf = Labfolder(
+                url,
+                'bench@example.com',
+                'bench',
+                out_dir=out_dir,
+                workers=args.workers,
+                stream_zip=args.stream_zip,
+                page_size=args.page_size,
+            )
+            start = time.perf_counter()
+            main_dir = lf.extract()
+            elapsed = time.perf_counter() - start
+            archives_size = sum(path.stat().st_size for path in Path(main_dir).glob('*.eln'))
+            metrics = json.loads(Path(main_dir).joinpath('metrics.json').read_text())
+    finally:
+        process.terminate()
+        process.wait()
+
+    payload_size = account.get_total_payload_size()
+    # ru_maxrss is in KB on linux but in bytes on macOS
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / (1024 * 1024 if sys.platform == 'darwin' else 1024)
+    print()
+    print(f'Entries: {args.entries} by {args.authors} authors, {args.entries * args.elements} elements')
+    print(f'Elapsed: {elapsed:.2f} s')
+    print(f'Entries/s: {args.entries / elapsed:.1f}')
+    print(f'Payload: {payload_size / 1e6:.1f} MB at {payload_size / 1e6 / elapsed:.1f} MB/s')
+    print(f'Archives: {archives_size / 1e6:.1f} MB')
+    print(f'Peak RSS: {peak_rss:.1f} MB')
+    print(f'CPU count: {os.cpu_count()}')
+    print(f"Retries: {metrics['counters'].get('requests.retries', 0)}")
+    for name, seconds in metrics['phases'].items():
+        print(f'Phase {name}: {seconds:.2f} s')
+    for name, seconds in metrics['timers'].items():
+        print(f'Workers in {name}: {seconds:.2f} s')
+
+
+if __name__ == '__main__':
+    main()
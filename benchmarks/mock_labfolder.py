@@ -0,0 +1,259 @@
+# TheELNConsortium/any2eln
+# © 2024 Nicolas CARPi @ Deltablot
+# License MIT
+
+# a local stand-in for the Labfolder v2 api, serving a synthetic account
+# run it with: uv run -m benchmarks.mock_labfolder --help
+
+import argparse
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Iterator
+from urllib.parse import parse_qs, urlparse
+
+# the types of elements, in the order they appear in an entry
+ELEMENT_TYPES = ['TEXT', 'FILE', 'IMAGE', 'TABLE', 'DATA', 'WELL_PLATE']
+# payloads are cut from this block, so they can be of any size without being held in memory
+BLOCK_SIZE = 1024 * 1024
+
+
+class Account:
+    """A synthetic account. Entries and elements are computed from their index, nothing is stored."""
+
+    def __init__(self, authors=10, entries=1000, elements=6, payload_size=64 * 1024, seed=0):
+        self.authors = authors
+        self.entries = entries
+        # elements per entry
+        self.elements = elements
+        # average size of FILE and IMAGE payloads, in bytes
+        self.payload_size = payload_size
+        self.seed = seed
+        self.block = random.Random(seed).randbytes(BLOCK_SIZE)
+
+    def get_entry(self, index: int) -> dict[str, Any]:
+        author_id = index % self.authors + 1
+        return {
+            'id': str(100000 + index),
+            'author_id': str(author_id),
+            'author': {
+                'id': str(author_id),
+                'first_name': f'First{author_id}',
+                'last_name': f'Last{author_id}',
+                'email': f'author{author_id}@example.com',
+            },
+            'project': {'title': f'Project {index % 7}'},
+            'title': f'Entry {index}',
+            'tags': ['benchmark'],
+            'creation_date': '2024-01-01T10:00:00.000+0000',
+            'version_date': '2024-01-02T10:00:00.000+0000',
+            'elements': [
+                {'id': str(index * self.elements + position + 1), 'type': ELEMENT_TYPES[position % len(ELEMENT_TYPES)]}
+                for position in range(self.elements)
+            ],
+        }
+
+    def get_element_type(self, element_id: int) -> str | None:
+        if not 0 < element_id <= self.entries * self.elements:
+            return None
+        return ELEMENT_TYPES[(element_id - 1) % self.elements % len(ELEMENT_TYPES)]
+
+    def get_payload_size(self, element_id: int) -> int:
+        # between half and one and a half of the average size
+        return self.payload_size // 2 + (element_id * 7919) % (self.payload_size + 1)
+
+    def get_total_payload_size(self) -> int:
+        return sum(
+            self.get_payload_size(element_id)
+            for element_id in range(1, self.entries * self.elements + 1)
+            if self.get_element_type(element_id) in ('FILE', 'IMAGE')
+        )
+
+    def get_payload(self, element_id: int, start: int, end: int) -> Iterator[bytes]:
+        """Bytes from start to end (excluded) of the payload of an element"""
+        offset = element_id * 4099
+        position = start
+        while position < end:
+            block_start = (offset + position) % BLOCK_SIZE
+            chunk = self.block[block_start : block_start + min(end - position, BLOCK_SIZE - block_start)]
+            position += len(chunk)
+            yield chunk
+
+    def get_metadata(self, element_type: str, element_id: int) -> dict[str, Any]:
+        id = str(element_id)
+        if element_type == 'TEXT':
+            return {'id': id, 'content': f'<p>Text of element {id}</p>'}
+        if element_type == 'FILE':
+            size = self.get_payload_size(element_id)
+            return {
+                'id': id,
+                'file_name': f'file-{id}.bin',
+                'file_size': str(size),
+                'content_type': 'application/octet-stream',
+            }
+        if element_type == 'IMAGE':
+            return {'id': id, 'title': f'image-{id}.png', 'original_file_content_type': 'image/png'}
+        if element_type in ('TABLE', 'WELL_PLATE'):
+            table = {
+                str(row): {str(col): {'value': row * col} for col in range(8) if (row + col) % 5} for row in range(20)
+            }
+            return {'id': id, 'title': f'table-{id}', 'content': {'sheets': {'Sheet1': {'data': {'dataTable': table}}}}}
+        return {'id': id, 'title': f'data-{id}', 'data': {'values': list(range(10))}}
+
+
+class Handler(BaseHTTPRequestHandler):
+    # set on the class by MockLabfolder
+    account: Account
+    latency: float
+    error_rate: float
+    ranges: bool
+    rng: random.Random
+
+    protocol_version = 'HTTP/1.1'
+    # headers and body are sent in separate writes, with Nagle the body waits for the ack of the headers
+    disable_nagle_algorithm = True
+
+    def log_message(self, format: str, *args: Any) -> None:
+        pass
+
+    def __send(self, status: int, body: bytes, headers: dict[str, str] | None = None) -> None:
+        self.send_response(status)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def __send_json(self, data: Any, headers: dict[str, str] | None = None) -> None:
+        body = json.dumps(data).encode()
+        etag = f'"{hashlib.md5(body).hexdigest()}"'
+        if self.headers.get('If-None-Match') == etag:
+            return self.__send(304, b'', {'ETag': etag})
+        self.__send(200, body, {'Content-Type': 'application/json', 'ETag': etag, **(headers or {})})
+
+    def __fail(self) -> bool:
+        """Simulate latency and transient errors, returns True if an error was sent"""
+        if self.latency > 0:
+            time.sleep(self.latency)
+        if self.rng.random() < self.error_rate:
+            self.__send(503, b'{}', {'Retry-After': '0'})
+            return True
+        return False
+
+    def do_POST(self) -> None:
+        length = int(self.headers.get('Content-Length', 0))
+        self.rfile.read(length)
+        if urlparse(self.path).path != '/api/v2/auth/login':
+            return self.__send(404, b'{}')
+        self.__send_json({'token': 'mock-token'})
+
+    def do_GET(self) -> None:
+        url = urlparse(self.path)
+        if self.headers.get('Authorization') != 'Bearer mock-token':
+            return self.__send(401, b'{}')
+        if self.__fail():
+            return
+        if url.path == '/api/v2/entries':
+            return self.__get_entries(parse_qs(url.query))
+        match = re.fullmatch(r'/api/v2/elements/([a-z-]+)/(\d+)(/download|/original-data)?', url.path)
+        if match is None:
+            return self.__send(404, b'{}')
+        element_type = match.group(1).upper().replace('-', '_')
+        element_id = int(match.group(2))
+        if self.account.get_element_type(element_id) != element_type:
+            return self.__send(404, b'{}')
+        if match.group(3) is None:
+            return self.__send_json(self.account.get_metadata(element_type, element_id))
+        if element_type not in ('FILE', 'IMAGE'):
+            return self.__send(400, b'{}')
+        self.__get_payload(element_id)
+
+    def __get_entries(self, query: dict[str, list[str]]) -> None:
+        offset = int(query.get('offset', ['0'])[0])
+        limit = int(query.get('limit', ['20'])[0])
+        entries = [self.account.get_entry(index) for index in range(offset, min(offset + limit, self.account.entries))]
+        self.__send_json(entries, {'x-total-count': str(self.account.entries)})
+
+    def __get_payload(self, element_id: int) -> None:
+        size = self.account.get_payload_size(element_id)
+        etag = f'"{element_id}-{size}"'
+        if self.headers.get('If-None-Match') == etag:
+            return self.__send(304, b'', {'ETag': etag})
+        start, end = 0, size
+        headers = {'Content-Type': 'application/octet-stream', 'ETag': etag, 'Accept-Ranges': 'bytes'}
+        status = 200
+        match = re.fullmatch(r'bytes=(\d+)-(\d*)', self.headers.get('Range', ''))
+        # like a real server, the whole payload is sent if it is not the version If-Range asks for
+        if match is not None and self.ranges and self.headers.get('If-Range', etag) == etag:
+            start = int(match.group(1))
+            end = min(size, int(match.group(2)) + 1) if match.group(2) else size
+            if start >= end:
+                return self.__send(416, b'', {'Content-Range': f'bytes */{size}'})
+            status = 206
+            headers['Content-Range'] = f'bytes {start}-{end - 1}/{size}'
+        self.send_response(status)
+        self.send_header('Content-Length', str(end - start))
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        for chunk in self.account.get_payload(element_id, start, end):
+            self.wfile.write(chunk)
+
+
+class MockLabfolder:
+    """Serve an account in a background thread"""
+
+    def __init__(self, account: Account, port=0, latency=0.0, error_rate=0.0, ranges=True):
+        attributes = {
+            'account': account,
+            'latency': latency,
+            'error_rate': error_rate,
+            'ranges': ranges,
+            'rng': random.Random(account.seed),
+        }
+        handler = type('MockHandler', (Handler,), attributes)
+        self.server = ThreadingHTTPServer(('127.0.0.1', port), handler)
+        self.server.daemon_threads = True
+        self.url = f'http://127.0.0.1:{self.server.server_address[1]}'
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def start(self) -> 'MockLabfolder':
+        self.thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def add_account_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument('--authors', type=int, default=10, help='number of authors')
+    parser.add_argument('--entries', type=int, default=1000, help='number of entries')
+    parser.add_argument('--elements', type=int, default=6, help='number of elements per entry')
+    parser.add_argument('--payload-size', type=int, default=64, help='average size of files and images in KB')
+    parser.add_argument('--latency', type=float, default=0.0, help='latency added to each request in ms')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='share of requests failing with a 503')
+    parser.add_argument('--no-range', action='store_true', help='ignore Range headers, like some servers do')
+    parser.add_argument('--seed', type=int, default=0, help='seed for the generated content')
+
+
+def get_account(args: argparse.Namespace) -> Account:
+    return Account(args.authors, args.entries, args.elements, args.payload_size * 1024, args.seed)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Mock Labfolder server')
+    parser.add_argument('--port', type=int, default=8080, help='port to listen on')
+    add_account_arguments(parser)
+    args = parser.parse_args()
+    mock = MockLabfolder(get_account(args), args.port, args.latency / 1000, args.error_rate, not args.no_range)
+    print(f'Serving on {mock.url}, use LABFOLDER_SERVER={mock.url}')
+    mock.server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()